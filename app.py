@@ -6,8 +6,10 @@ from config import APP_NAME, APP_ICON, VECTORSTORE_PATH
 
 # Import modules
 from modules.database import get_db_connection,init_database
-from modules.vectorstore import rebuild_vectorstore
+from modules.vectorstore import rebuild_vectorstore, start_warmup
 from modules.knowledge import get_knowledge_stats, search_knowledge_items
+from modules.index_queue import notify_index_worker
+from modules.duplicates import backfill_item_signatures
 
 # Import UI components
 from modules.ui.login import show_login_page, show_register_page
@@ -26,11 +28,33 @@ st.set_page_config(
     layout="wide"
 )
 
+@st.cache_resource
+def resume_index_jobs():
+    """Wake the index worker once per process for jobs left over from a previous run"""
+    # Saving or deleting an item notifies the worker itself, so page reruns need not
+    notify_index_worker()
+    return True
+
+@st.cache_resource
+def backfill_signatures():
+    """Give items saved before near-duplicate detection their signatures, once per process"""
+    return backfill_item_signatures()
+
 def main():
     """Main application entry point"""
     # Initialize database
     init_database()
     
+    # Load the embedding model and vector index in the background (first run only)
+    start_warmup()
+    
+    # Index saved items in the background (here, or in the vector service when it is up),
+    # picking up jobs left over from a previous run
+    resume_index_jobs()
+    
+    # Near-duplicate detection needs signatures for items saved before it existed
+    backfill_signatures()
+    
     # Inject global CSS theme
     inject_global_css()
     
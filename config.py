@@ -19,7 +19,119 @@ os.makedirs(VECTORSTORE_PATH, exist_ok=True)
 
 # Vector store settings
 EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+# "torch" (sentence-transformers) or "onnx" (int8-quantized export of EMBEDDING_MODEL run with
+# onnxruntime; create it with `python -m modules.embeddings export-onnx`)
+EMBEDDING_BACKEND = "torch"
+ONNX_MODEL_DIR = os.path.join(ROOT_DIR, 'onnx_model')
+# Lowest cosine similarity between torch and ONNX vectors accepted by the parity check
+ONNX_PARITY_MIN_COSINE = 0.99
+EMBEDDING_BATCH_SIZE = 64
+# Processes in the encode pool used for large batches (0 or 1 encodes in-process)
+EMBEDDING_WORKERS = 0
 DEFAULT_TOP_K = 5
+# File touched once the background warm-up has loaded the model and index, for exec-style
+# health checks (None disables it); readiness is also available from get_warmup_status()
+WARMUP_READY_FILE = None
+# Recent query vectors kept in memory so repeated searches skip the embedding model
+QUERY_CACHE_SIZE = 1024
+# Semantic searches that arrive while another batch is running are coalesced into one encode and
+# one index search of up to QUERY_BATCH_MAX_SIZE queries; while searches are concurrent, a new
+# batch first waits QUERY_BATCH_WINDOW_MS for more to arrive (a lone search never waits)
+QUERY_BATCH_WINDOW_MS = 2
+QUERY_BATCH_MAX_SIZE = 32
+# Optional vector service that owns the embedding model and index for every app process
+# ("unix:/path/to/socket" or "host:port", None keeps everything in-process); start it with
+# `python -m modules.vector_service`. App processes fall back to in-process while it is down
+VECTOR_SERVICE_ADDRESS = None
+VECTOR_SERVICE_TIMEOUT_SECONDS = 60
+# Texts per encode request to the vector service, so each request finishes well within the timeout
+VECTOR_SERVICE_ENCODE_BATCH_SIZE = 256
+# After a failed connection, stay in-process this long before trying the service again
+VECTOR_SERVICE_RETRY_SECONDS = 10
+# Size of the append-only delta log (bytes) that triggers merging it into the base index
+DELTA_LOG_COMPACT_BYTES = 16 * 1024 * 1024
+# Background indexing queue (index_jobs table): jobs embedded together per batch, how often the
+# worker polls when not woken, and retry backoff (doubling from the base, capped) before a job
+# is marked failed
+INDEX_JOB_BATCH_SIZE = 32
+INDEX_WORKER_POLL_SECONDS = 5
+INDEX_JOB_RETRY_BASE_SECONDS = 10
+INDEX_JOB_RETRY_MAX_SECONDS = 600
+INDEX_JOB_MAX_ATTEMPTS = 6
+# A job claimed for longer than this (e.g. by a process that died) is picked up again
+INDEX_JOB_CLAIM_TIMEOUT_SECONDS = 600
+# Memory-map the saved index read-only instead of reading it into RAM (writes go to a small
+# in-memory delta index until the next compaction)
+INDEX_MMAP = True
+
+# Distance metric: "l2" (Euclidean distance between embeddings) or "cosine" (normalized embeddings
+# in an inner-product index); changing it rebuilds the index from the embedding cache on next load
+INDEX_METRIC = "l2"
+# Default cut-off for similarity-threshold semantic search (cosine similarity, 0-1)
+SEMANTIC_MIN_SIMILARITY = 0.5
+
+# ANN index selection: "auto" picks by vector count, or force "flat", "ivf" or "hnsw"
+INDEX_TYPE = "auto"
+IVF_MIN_VECTORS = 20000
+HNSW_MIN_VECTORS = 500000
+# Retrain IVF centroids and quantizer codebooks once the corpus grows this many times past the training size
+INDEX_RETRAIN_GROWTH = 4
+IVF_NPROBE = 16
+HNSW_M = 32
+HNSW_EF_CONSTRUCTION = 80
+HNSW_EF_SEARCH = 64
+# Rebuild an HNSW index once deleted (tombstoned) vectors exceed this share of live ones
+HNSW_MAX_DELETED_RATIO = 0.2
+
+# Compressed vector storage: None (float32), "sq8" (4x smaller) or "pq" (PQ_M bytes per vector)
+INDEX_QUANTIZATION = None
+# PQ sub-quantizers; must divide the indexed dimension (384 for MiniLM, or INDEX_REDUCED_DIM), 48 gives 32x compression
+PQ_M = 48
+PQ_MIN_TRAINING_VECTORS = 10000
+# Dimensionality reduction before indexing: None, "pca" (learned from the corpus) or "rotation"
+# (random rotation), keeping INDEX_REDUCED_DIM dimensions; queries are reduced the same way.
+# The admin System Stats tab reports the recall of candidate dimensions on the current corpus
+INDEX_REDUCTION = None
+INDEX_REDUCED_DIM = 192
+# PCA waits for this many vectors (and at least the embedding dimension) before it is trained
+REDUCTION_MIN_TRAINING_VECTORS = 1000
+# With a compressed or reduced index, fetch RERANK_FACTOR x top_k candidates and re-rank them exactly (0 disables)
+RERANK_FACTOR = 4
+
+# Chunking settings (characters) for long documents
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 200
+# How chunk hits are collapsed into item scores: "max" (best passage) or "sum" (all passages)
+CHUNK_AGGREGATION = "max"
+# Chunk hits fetched per requested item, so several passages of one item do not crowd out others
+CHUNK_FETCH_MULTIPLIER = 4
+# Nearest items precomputed per item for the "related knowledge" lists
+RELATED_ITEMS_K = 5
+
+# Optional cross-encoder re-ranking of the top semantic results (None disables it),
+# e.g. "cross-encoder/ms-marco-MiniLM-L-6-v2"
+CROSS_ENCODER_MODEL = None
+CROSS_ENCODER_CANDIDATES = 20
+CROSS_ENCODER_BATCH_SIZE = 8
+# Candidates not scored within this many milliseconds keep their vector-search order
+CROSS_ENCODER_BUDGET_MS = 300
+
+# Hybrid search: reciprocal-rank fusion constant and per-leg latency budgets (milliseconds)
+HYBRID_RRF_K = 60
+HYBRID_KEYWORD_BUDGET_MS = 300
+HYBRID_SEMANTIC_BUDGET_MS = 2000
+
+# Near-duplicate check when adding knowledge: "warn" (save only when confirmed), "block" or None (off)
+DUPLICATE_ACTION = "warn"
+# Estimated Jaccard similarity of character shingles at which content counts as a near-duplicate
+DUPLICATE_SIMILARITY = 0.8
+DUPLICATE_SHINGLE_SIZE = 8
+# MinHash signature length, split into bands for the candidate lookup (must divide evenly)
+MINHASH_PERMUTATIONS = 64
+MINHASH_BANDS = 16
+# Vector probe: passages sampled from new content, and the cosine similarity at which a stored passage matches
+DUPLICATE_PROBE_PASSAGES = 3
+DUPLICATE_PASSAGE_SIMILARITY = 0.95
 
 # Security settings
 PASSWORD_MIN_LENGTH = 8
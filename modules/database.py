@@ -46,6 +46,94 @@ def init_database():
     )
     ''')
     
+    # Create embedding cache table (vectors keyed by content hash and model)
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS embedding_cache (
+        text_hash TEXT NOT NULL,
+        model TEXT NOT NULL,
+        vector BLOB NOT NULL,
+        PRIMARY KEY (text_hash, model)
+    )
+    ''')
+    
+    # Create vector indexing queue, consumed by the background worker in modules.index_queue
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS index_jobs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        item_id INTEGER NOT NULL,
+        status TEXT NOT NULL DEFAULT 'pending',
+        attempts INTEGER NOT NULL DEFAULT 0,
+        next_attempt REAL NOT NULL,
+        claimed_at REAL,
+        last_error TEXT,
+        created_date TEXT NOT NULL
+    )
+    ''')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_index_jobs_status ON index_jobs (status, next_attempt)")
+    
+    # Create precomputed nearest-neighbour lists for "related knowledge", kept fresh by the indexing worker
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS related_items (
+        item_id INTEGER NOT NULL,
+        related_id INTEGER NOT NULL,
+        rank INTEGER NOT NULL,
+        distance REAL NOT NULL,
+        PRIMARY KEY (item_id, rank)
+    )
+    ''')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_related_items_related ON related_items (related_id)")
+    
+    # Create MinHash signatures of item content and their LSH band buckets for the near-duplicate check
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS item_signatures (
+        item_id INTEGER PRIMARY KEY,
+        signature BLOB NOT NULL
+    )
+    ''')
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS signature_bands (
+        band INTEGER NOT NULL,
+        bucket INTEGER NOT NULL,
+        item_id INTEGER NOT NULL
+    )
+    ''')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_signature_bands_bucket ON signature_bands (band, bucket)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_signature_bands_item ON signature_bands (item_id)")
+    
+    # Create full-text index over knowledge items, kept in sync by triggers
+    try:
+        fts_exists = c.execute(
+            "SELECT COUNT(*) FROM sqlite_master WHERE type = 'table' AND name = 'knowledge_fts'"
+        ).fetchone()[0]
+        c.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS knowledge_fts USING fts5(
+            title, content, tags, content='knowledge_items', content_rowid='id'
+        )
+        ''')
+        c.execute('''
+        CREATE TRIGGER IF NOT EXISTS knowledge_fts_insert AFTER INSERT ON knowledge_items BEGIN
+            INSERT INTO knowledge_fts (rowid, title, content, tags) VALUES (new.id, new.title, new.content, new.tags);
+        END
+        ''')
+        c.execute('''
+        CREATE TRIGGER IF NOT EXISTS knowledge_fts_delete AFTER DELETE ON knowledge_items BEGIN
+            INSERT INTO knowledge_fts (knowledge_fts, rowid, title, content, tags) VALUES ('delete', old.id, old.title, old.content, old.tags);
+        END
+        ''')
+        # Only edits to indexed columns touch the full-text index (not e.g. vector_indexed flips)
+        c.execute('''
+        CREATE TRIGGER IF NOT EXISTS knowledge_fts_update AFTER UPDATE OF title, content, tags ON knowledge_items BEGIN
+            INSERT INTO knowledge_fts (knowledge_fts, rowid, title, content, tags) VALUES ('delete', old.id, old.title, old.content, old.tags);
+            INSERT INTO knowledge_fts (rowid, title, content, tags) VALUES (new.id, new.title, new.content, new.tags);
+        END
+        ''')
+        # Index items that existed before the full-text table
+        if not fts_exists:
+            c.execute("INSERT INTO knowledge_fts (knowledge_fts) VALUES ('rebuild')")
+    except sqlite3.OperationalError:
+        # SQLite built without FTS5; keyword ranking falls back to a LIKE scan
+        pass
+    
     # Add admin user if not exists
     admin_exists = c.execute("SELECT COUNT(*) FROM users WHERE username = ?", 
                             (DEFAULT_ADMIN_USERNAME,)).fetchone()[0]
@@ -0,0 +1,163 @@
+import zlib
+import hashlib
+import numpy as np
+from modules.database import get_db_connection
+from config import (
+    DUPLICATE_SIMILARITY, DUPLICATE_SHINGLE_SIZE, MINHASH_PERMUTATIONS, MINHASH_BANDS,
+    DUPLICATE_PROBE_PASSAGES, DUPLICATE_PASSAGE_SIMILARITY
+)
+
+# Universal hash family (a * x + b) mod p, one (a, b) pair per MinHash permutation;
+# fixed seed so signatures stay comparable across processes and restarts. p is the
+# largest 32-bit prime, so every hash fits the uint32 signature
+MINHASH_PRIME = np.uint64(4294967291)
+minhash_random = np.random.RandomState(1)
+MINHASH_A = minhash_random.randint(1, 1 << 31, size=MINHASH_PERMUTATIONS).astype(np.uint64)
+MINHASH_B = minhash_random.randint(0, 1 << 31, size=MINHASH_PERMUTATIONS).astype(np.uint64)
+
+def get_shingles(content, size=DUPLICATE_SHINGLE_SIZE):
+    """Hashed character shingles of case- and whitespace-normalized content
+
+    Characters rather than words, so text without spaces between words (e.g. Thai) works too.
+    """
+    text = " ".join(content.lower().split())
+    if len(text) <= size:
+        return {zlib.crc32(text.encode("utf-8"))}
+    return set(zlib.crc32(text[i:i + size].encode("utf-8")) for i in range(len(text) - size + 1))
+
+def minhash_signature(content):
+    """MinHash signature of the content's shingles; matching positions estimate Jaccard similarity"""
+    shingles = np.fromiter(get_shingles(content), dtype=np.uint64)
+    signature = np.empty(MINHASH_PERMUTATIONS, dtype=np.uint32)
+    for i in range(MINHASH_PERMUTATIONS):
+        # a and b are below 2^31 and shingles below 2^32, so a * x + b fits in 64 bits
+        signature[i] = ((MINHASH_A[i] * shingles + MINHASH_B[i]) % MINHASH_PRIME).min()
+    return signature
+
+def signature_buckets(signature):
+    """LSH bucket of each band; items sharing any bucket are near-duplicate candidates"""
+    rows = MINHASH_PERMUTATIONS // MINHASH_BANDS
+    return [
+        int.from_bytes(hashlib.blake2b(signature[band * rows:(band + 1) * rows].tobytes(), digest_size=7).digest(), "big")
+        for band in range(MINHASH_BANDS)
+    ]
+
+def estimate_similarity(signature_a, signature_b):
+    """Estimated Jaccard similarity of the shingle sets behind two signatures"""
+    return float(np.mean(signature_a == signature_b))
+
+def store_item_signature(c, item_id, content):
+    """Save an item's signature and band buckets on the caller's cursor (commits with the item change)"""
+    signature = minhash_signature(content)
+    c.execute("DELETE FROM signature_bands WHERE item_id = ?", (item_id,))
+    c.execute(
+        "INSERT OR REPLACE INTO item_signatures (item_id, signature) VALUES (?, ?)",
+        (item_id, signature.tobytes())
+    )
+    c.executemany(
+        "INSERT INTO signature_bands (band, bucket, item_id) VALUES (?, ?, ?)",
+        [(band, bucket, item_id) for band, bucket in enumerate(signature_buckets(signature))]
+    )
+
+def delete_item_signature(c, item_id):
+    """Remove a deleted item's signature on the caller's cursor"""
+    c.execute("DELETE FROM item_signatures WHERE item_id = ?", (item_id,))
+    c.execute("DELETE FROM signature_bands WHERE item_id = ?", (item_id,))
+
+def backfill_item_signatures():
+    """Compute signatures of items saved before signatures existed; returns how many
+
+    Run once per app process at startup; items saved since carry their own.
+    """
+    conn = get_db_connection()
+    c = conn.cursor()
+    c.execute("SELECT id, content FROM knowledge_items WHERE id NOT IN (SELECT item_id FROM item_signatures)")
+    rows = c.fetchall()
+    for row in rows:
+        store_item_signature(c, row['id'], row['content'])
+    conn.commit()
+    conn.close()
+    return len(rows)
+
+def find_minhash_duplicates(content, exclude_id=None):
+    """Items whose estimated shingle similarity to the content reaches DUPLICATE_SIMILARITY, as {item id: similarity}"""
+    signature = minhash_signature(content)
+    conn = get_db_connection()
+    c = conn.cursor()
+    c.execute(
+        "SELECT DISTINCT s.item_id, s.signature FROM signature_bands b JOIN item_signatures s ON s.item_id = b.item_id "
+        "WHERE " + " OR ".join(["(b.band = ? AND b.bucket = ?)"] * MINHASH_BANDS),
+        [value for band, bucket in enumerate(signature_buckets(signature)) for value in (band, bucket)]
+    )
+    rows = c.fetchall()
+    conn.close()
+
+    duplicates = {}
+    for row in rows:
+        similarity = estimate_similarity(signature, np.frombuffer(row['signature'], dtype=np.uint32))
+        if row['item_id'] != exclude_id and similarity >= DUPLICATE_SIMILARITY:
+            duplicates[row['item_id']] = similarity
+    return duplicates
+
+def find_vector_duplicates(content, exclude_id=None):
+    """Items holding a close match for every sampled passage of the content, as {item id: similarity}
+
+    Probes only once the model is loaded, so saving never waits on it. The
+    probe passages go through the embedding cache, so indexing the item after
+    it is saved does not embed them again.
+    """
+    from modules.vectorstore import is_ready, split_into_chunks, find_similar_passages, distance_to_similarity
+
+    if not is_ready():
+        return {}
+
+    chunks = split_into_chunks(content)
+    step = max(1, len(chunks) // DUPLICATE_PROBE_PASSAGES)
+    probes = chunks[::step][:DUPLICATE_PROBE_PASSAGES]
+
+    matches = None
+    for hits in find_similar_passages(probes, k=DUPLICATE_PROBE_PASSAGES):
+        close = {}
+        for doc_id, _, distance in hits:
+            similarity = distance_to_similarity(distance)
+            if doc_id != exclude_id and similarity >= DUPLICATE_PASSAGE_SIMILARITY:
+                close[doc_id] = max(close.get(doc_id, 0.0), similarity)
+        if matches is None:
+            matches = close
+        else:
+            matches = {doc_id: min(matches[doc_id], close[doc_id]) for doc_id in matches if doc_id in close}
+    return matches or {}
+
+def find_near_duplicates(content, exclude_id=None, limit=3):
+    """Existing items that look like near-duplicates of the content, as (item, similarity) pairs, closest first
+
+    The MinHash lookup catches copies with small edits (e.g. the same manual
+    uploaded twice); the vector probe catches reformatted or re-extracted copies
+    whose characters differ but whose passages embed to the same place.
+    """
+    duplicates = find_minhash_duplicates(content, exclude_id)
+    try:
+        for doc_id, similarity in find_vector_duplicates(content, exclude_id).items():
+            duplicates[doc_id] = max(duplicates.get(doc_id, 0.0), similarity)
+    except Exception:
+        # The vector probe is best effort; the MinHash result stands on its own
+        pass
+
+    if not duplicates:
+        return []
+
+    ranked = sorted(duplicates.items(), key=lambda pair: pair[1], reverse=True)[:limit]
+    conn = get_db_connection()
+    c = conn.cursor()
+    results = []
+    for doc_id, similarity in ranked:
+        c.execute("SELECT id, title, category FROM knowledge_items WHERE id = ?", (doc_id,))
+        row = c.fetchone()
+        if row:
+            results.append((dict(row), similarity))
+    conn.close()
+    return results
+
+def format_duplicate_message(duplicates):
+    """One-line description of near-duplicates found by find_near_duplicates()"""
+    return ", ".join(f"'{item['title']}' (#{item['id']}, {similarity * 100:.0f}% similar)" for item, similarity in duplicates)
@@ -0,0 +1,346 @@
+import os
+import sys
+import json
+import time
+import atexit
+import hashlib
+import inspect
+import argparse
+import numpy as np
+from langchain.schema.embeddings import Embeddings
+from modules.database import get_db_connection
+from config import (
+    EMBEDDING_MODEL, EMBEDDING_BATCH_SIZE, EMBEDDING_WORKERS, ONNX_MODEL_DIR, ONNX_PARITY_MIN_COSINE
+)
+
+class EmbeddingEngine(Embeddings):
+    """Sentence-transformer embeddings with explicit batching, length-bucketed
+    batches, an optional multi-process encode pool and progress callbacks
+    """
+
+    def __init__(self, model_name=EMBEDDING_MODEL, batch_size=EMBEDDING_BATCH_SIZE, workers=EMBEDDING_WORKERS):
+        from sentence_transformers import SentenceTransformer
+
+        self.model_name = model_name
+        # Embedding cache key; other backends of the same model produce slightly different vectors
+        self.cache_name = model_name
+        self.model = SentenceTransformer(model_name)
+        self.dimension = self.model.get_sentence_embedding_dimension()
+        self.batch_size = batch_size
+        self.workers = workers
+        self.pool = None
+
+    def encode(self, texts, progress_callback=None):
+        """Encode texts into a float32 matrix, calling progress_callback(done, total) after each batch
+
+        Vectors for texts seen before are read from the persistent embedding cache;
+        only new texts go through the model.
+        """
+        texts = list(texts)
+        total = len(texts)
+        vectors = np.zeros((total, self.dimension), dtype=np.float32)
+        if not total:
+            return vectors
+
+        conn = get_db_connection()
+        try:
+            # Fill cache hits and group the remaining positions by content hash
+            hashes = [text_hash(text) for text in texts]
+            cached = load_cached_embeddings(conn, set(hashes), self.cache_name)
+            missing = {}
+            for position, digest in enumerate(hashes):
+                if digest in cached:
+                    vectors[position] = cached[digest]
+                else:
+                    missing.setdefault(digest, []).append(position)
+
+            done = total - sum(len(positions) for positions in missing.values())
+            if progress_callback and done:
+                progress_callback(done, total)
+
+            # Bucket unique new texts by length so each batch is padded to similar lengths
+            pending = sorted(missing, key=lambda digest: -len(texts[missing[digest][0]]))
+            pool = self.get_pool() if len(pending) > self.batch_size * max(self.workers, 1) else None
+            step = self.batch_size * self.workers * 4 if pool else self.batch_size
+
+            for start in range(0, len(pending), step):
+                digests = pending[start:start + step]
+                batch = [texts[missing[digest][0]] for digest in digests]
+                batch_vectors = self.encode_batch(batch, pool)
+
+                for digest, vector in zip(digests, batch_vectors):
+                    vectors[missing[digest]] = vector
+                    done += len(missing[digest])
+                store_cached_embeddings(conn, zip(digests, batch_vectors), self.cache_name)
+
+                if progress_callback:
+                    progress_callback(done, total)
+        finally:
+            conn.close()
+
+        return vectors
+
+    def encode_batch(self, batch, pool=None):
+        """Run the model on one batch of texts, bypassing the cache"""
+        if pool:
+            batch_vectors = self.model.encode_multi_process(batch, pool, batch_size=self.batch_size)
+        else:
+            batch_vectors = self.model.encode(batch, batch_size=self.batch_size, convert_to_numpy=True)
+        return np.asarray(batch_vectors, dtype=np.float32)
+
+    def get_pool(self):
+        """Start the multi-process encode pool on first use (None when disabled)"""
+        if self.workers <= 1:
+            return None
+        if self.pool is None:
+            self.pool = self.model.start_multi_process_pool(target_devices=["cpu"] * self.workers)
+            atexit.register(self.close)
+        return self.pool
+
+    def close(self):
+        """Stop the multi-process encode pool"""
+        if self.pool is not None:
+            self.model.stop_multi_process_pool(self.pool)
+            self.pool = None
+
+    def embed_documents(self, texts):
+        """Embed documents for indexing"""
+        return self.encode(texts).tolist()
+
+    def embed_query(self, text):
+        """Embed a single search query"""
+        return self.encode_batch([text])[0].tolist()
+
+    def embed_queries(self, texts):
+        """Embed several search queries in one forward pass, bypassing the cache (float32 matrix)"""
+        return self.encode_batch(list(texts))
+
+class OnnxEmbeddingEngine(EmbeddingEngine):
+    """EMBEDDING_MODEL run from an int8-quantized ONNX export with onnxruntime
+
+    Needs neither torch nor sentence-transformers at runtime, which keeps
+    startup fast and memory low on CPU-only hosts. onnxruntime spreads each
+    batch over the CPU cores itself, so there is no process pool. Create the
+    export with export_onnx_model() first.
+    """
+
+    def __init__(self, model_dir=ONNX_MODEL_DIR, batch_size=EMBEDDING_BATCH_SIZE):
+        import onnxruntime
+        from tokenizers import Tokenizer
+
+        with open(os.path.join(model_dir, "onnx_config.json"), encoding="utf-8") as f:
+            config = json.load(f)
+
+        self.model_name = config["model_name"]
+        self.cache_name = f"{config['model_name']}#onnx-int8"
+        self.dimension = config["dimension"]
+        self.normalize = config["normalize"]
+        self.batch_size = batch_size
+        self.workers = 0
+        self.pool = None
+
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_dir, "tokenizer.json"))
+        self.tokenizer.enable_truncation(config["max_seq_length"])
+        self.tokenizer.enable_padding(pad_id=config["pad_token_id"], pad_token=config["pad_token"])
+        self.session = onnxruntime.InferenceSession(
+            os.path.join(model_dir, "model_int8.onnx"), providers=["CPUExecutionProvider"]
+        )
+        self.input_names = [model_input.name for model_input in self.session.get_inputs()]
+
+    def encode_batch(self, batch, pool=None):
+        """Tokenize, run the ONNX graph and mean-pool one batch of texts"""
+        encodings = self.tokenizer.encode_batch(list(batch))
+        inputs = {
+            "input_ids": np.array([encoding.ids for encoding in encodings], dtype=np.int64),
+            "attention_mask": np.array([encoding.attention_mask for encoding in encodings], dtype=np.int64),
+            "token_type_ids": np.array([encoding.type_ids for encoding in encodings], dtype=np.int64)
+        }
+        hidden = self.session.run(["last_hidden_state"], {name: inputs[name] for name in self.input_names})[0]
+
+        # Same pooling as the sentence-transformers model: mean over real tokens, then L2 norm
+        mask = inputs["attention_mask"][:, :, None].astype(np.float32)
+        vectors = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        if self.normalize:
+            vectors /= np.clip(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12, None)
+        return vectors.astype(np.float32)
+
+    def get_pool(self):
+        """onnxruntime is already multi-threaded"""
+        return None
+
+def export_onnx_model(model_name=EMBEDDING_MODEL, output_dir=ONNX_MODEL_DIR):
+    """Export a mean-pooled sentence-transformers model to ONNX and quantize its weights to int8
+
+    This is the only step that needs torch; OnnxEmbeddingEngine loads the result.
+    """
+    import torch
+    from sentence_transformers import SentenceTransformer, models
+    from onnxruntime.quantization import quantize_dynamic, QuantType
+
+    model = SentenceTransformer(model_name, device="cpu")
+    transformer, pooling = model[0], model[1]
+    if not isinstance(pooling, models.Pooling) or pooling.get_pooling_mode_str() != "mean":
+        raise ValueError(f"{model_name} does not use mean pooling, which the ONNX backend implements")
+
+    os.makedirs(output_dir, exist_ok=True)
+    fp32_path = os.path.join(output_dir, "model.onnx")
+    int8_path = os.path.join(output_dir, "model_int8.onnx")
+
+    tokenizer = model.tokenizer
+    sample = tokenizer(["an example sentence"], return_tensors="pt")
+    # Graph inputs follow the forward() signature, not the tokenizer's key order
+    forward_parameters = inspect.signature(transformer.auto_model.forward).parameters
+    input_names = [name for name in forward_parameters if name in sample]
+    sample = {name: sample[name] for name in input_names}
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names + ["last_hidden_state"]}
+
+    # Newer torch defaults to the dynamo exporter, which needs the extra onnxscript package
+    export_options = {}
+    if "dynamo" in inspect.signature(torch.onnx.export).parameters:
+        export_options["dynamo"] = False
+
+    transformer.auto_model.eval()
+    with torch.no_grad():
+        torch.onnx.export(
+            transformer.auto_model, (sample,), fp32_path,
+            input_names=input_names, output_names=["last_hidden_state"],
+            dynamic_axes=dynamic_axes, opset_version=14, **export_options
+        )
+    quantize_dynamic(fp32_path, int8_path, weight_type=QuantType.QInt8)
+    os.remove(fp32_path)
+
+    tokenizer.save_pretrained(output_dir)
+    with open(os.path.join(output_dir, "onnx_config.json"), "w", encoding="utf-8") as f:
+        json.dump({
+            "model_name": model_name,
+            "dimension": model.get_sentence_embedding_dimension(),
+            "max_seq_length": model.max_seq_length,
+            "normalize": any(isinstance(module, models.Normalize) for module in model),
+            "pad_token": tokenizer.pad_token,
+            "pad_token_id": tokenizer.pad_token_id
+        }, f, indent=2)
+    return output_dir
+
+def check_onnx_parity(texts=None, model_dir=ONNX_MODEL_DIR):
+    """Compare the ONNX backend against the torch model on the same texts
+
+    Defaults to passages from the knowledge base (plus a few fixed sentences).
+    Returns cosine similarity statistics, whether the worst case clears
+    ONNX_PARITY_MIN_COSINE, and the encode time of each backend.
+    """
+    onnx_engine = OnnxEmbeddingEngine(model_dir)
+    torch_engine = EmbeddingEngine(onnx_engine.model_name)
+
+    if texts is None:
+        texts = [
+            "How do I set up the deployment pipeline?",
+            "Password reset instructions for new employees",
+            "คู่มือการใช้งานระบบจัดการความรู้"
+        ]
+        conn = get_db_connection()
+        c = conn.cursor()
+        c.execute("SELECT content FROM knowledge_items ORDER BY id LIMIT 200")
+        texts += [row['content'][:1000] for row in c.fetchall()]
+        conn.close()
+
+    timings = {}
+    vectors = {}
+    for name, engine in (("torch", torch_engine), ("onnx", onnx_engine)):
+        started = time.perf_counter()
+        vectors[name] = np.concatenate([
+            engine.encode_batch(texts[start:start + engine.batch_size])
+            for start in range(0, len(texts), engine.batch_size)
+        ])
+        timings[name] = (time.perf_counter() - started) * 1000
+
+    torch_vectors = vectors["torch"] / np.linalg.norm(vectors["torch"], axis=1, keepdims=True)
+    onnx_vectors = vectors["onnx"] / np.linalg.norm(vectors["onnx"], axis=1, keepdims=True)
+    cosines = (torch_vectors * onnx_vectors).sum(axis=1)
+    return {
+        "texts": len(texts),
+        "min_cosine": float(cosines.min()),
+        "mean_cosine": float(cosines.mean()),
+        "passed": bool(cosines.min() >= ONNX_PARITY_MIN_COSINE),
+        "torch_ms": timings["torch"],
+        "onnx_ms": timings["onnx"]
+    }
+
+def text_hash(text):
+    """Content hash used as the embedding cache key"""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+def load_cached_embeddings(conn, hashes, model_name):
+    """Get cached vectors for the given content hashes as {hash: vector}"""
+    cached = {}
+    hashes = list(hashes)
+    c = conn.cursor()
+
+    # Stay under SQLite's bound-parameter limit
+    for start in range(0, len(hashes), 500):
+        batch = hashes[start:start + 500]
+        placeholders = ",".join("?" * len(batch))
+        c.execute(
+            f"SELECT text_hash, vector FROM embedding_cache WHERE model = ? AND text_hash IN ({placeholders})",
+            [model_name] + batch
+        )
+        for row in c.fetchall():
+            cached[row['text_hash']] = np.frombuffer(row['vector'], dtype=np.float32)
+
+    return cached
+
+def find_cached_hashes(conn, hashes, model_name):
+    """Get which of the given content hashes have a cached vector, without loading the vectors"""
+    found = set()
+    hashes = list(hashes)
+    c = conn.cursor()
+
+    for start in range(0, len(hashes), 500):
+        batch = hashes[start:start + 500]
+        placeholders = ",".join("?" * len(batch))
+        c.execute(
+            f"SELECT text_hash FROM embedding_cache WHERE model = ? AND text_hash IN ({placeholders})",
+            [model_name] + batch
+        )
+        found.update(row['text_hash'] for row in c.fetchall())
+
+    return found
+
+def store_cached_embeddings(conn, entries, model_name):
+    """Save (hash, vector) pairs to the embedding cache"""
+    c = conn.cursor()
+    c.executemany(
+        "INSERT OR REPLACE INTO embedding_cache (text_hash, model, vector) VALUES (?, ?, ?)",
+        [(digest, model_name, np.asarray(vector, dtype=np.float32).tobytes()) for digest, vector in entries]
+    )
+    conn.commit()
+
+def prune_cached_embeddings(conn, keep_hashes, model_name):
+    """Delete cached vectors of other models and of hashes not in keep_hashes; returns how many"""
+    c = conn.cursor()
+    c.execute("DELETE FROM embedding_cache WHERE model != ?", (model_name,))
+    removed = c.rowcount
+
+    c.execute("SELECT text_hash FROM embedding_cache WHERE model = ?", (model_name,))
+    unused = [row['text_hash'] for row in c.fetchall() if row['text_hash'] not in keep_hashes]
+    c.executemany(
+        "DELETE FROM embedding_cache WHERE model = ? AND text_hash = ?",
+        [(model_name, digest) for digest in unused]
+    )
+    conn.commit()
+    return removed + len(unused)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manage the ONNX embedding backend")
+    parser.add_argument("command", choices=["export-onnx", "check-onnx"])
+    args = parser.parse_args()
+
+    if args.command == "export-onnx":
+        print(f"Exported {EMBEDDING_MODEL} to {export_onnx_model()}")
+
+    report = check_onnx_parity()
+    print(
+        f"Parity over {report['texts']} texts: min cosine {report['min_cosine']:.4f}, "
+        f"mean {report['mean_cosine']:.4f} ({'passed' if report['passed'] else 'FAILED'})"
+    )
+    print(f"Encode time: torch {report['torch_ms']:.0f} ms, onnx {report['onnx_ms']:.0f} ms")
+    sys.exit(0 if report["passed"] else 1)
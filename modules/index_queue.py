@@ -0,0 +1,249 @@
+import time
+import threading
+from datetime import datetime
+from modules.database import get_db_connection
+from modules.vector_service import call_vector_service, VectorServiceUnavailable
+from config import (
+    INDEX_JOB_BATCH_SIZE, INDEX_WORKER_POLL_SECONDS, INDEX_JOB_RETRY_BASE_SECONDS,
+    INDEX_JOB_RETRY_MAX_SECONDS, INDEX_JOB_MAX_ATTEMPTS, INDEX_JOB_CLAIM_TIMEOUT_SECONDS
+)
+
+# Set when a job is queued so the worker does not wait for its next poll
+index_worker_wakeup = threading.Event()
+
+# Whether this process has started its worker thread, see start_index_worker()
+index_worker_state = {"started": False, "last_error": None}
+index_worker_lock = threading.Lock()
+
+def enqueue_index_job(c, item_id):
+    """Queue a knowledge item for (re)indexing on the caller's cursor
+
+    The job commits in the same transaction as the item change, so an item is
+    never saved without a job. A job syncs the index with the item's current row:
+    it re-embeds the item, or removes its vectors if the item has been deleted.
+    """
+    current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    c.execute(
+        "INSERT INTO index_jobs (item_id, status, attempts, next_attempt, created_date) VALUES (?, 'pending', 0, ?, ?)",
+        (item_id, time.time(), current_time)
+    )
+
+def notify_index_worker():
+    """Wake the worker after a job has been committed
+
+    The vector service runs the worker when it is up; otherwise this process
+    starts its own.
+    """
+    try:
+        call_vector_service("process_jobs")
+        return
+    except VectorServiceUnavailable:
+        pass
+    start_index_worker()
+    index_worker_wakeup.set()
+
+def start_index_worker():
+    """Start the background indexing thread, once per process"""
+    with index_worker_lock:
+        if index_worker_state["started"]:
+            return
+        index_worker_state["started"] = True
+    threading.Thread(target=run_index_worker, name="index-worker", daemon=True).start()
+
+def run_index_worker():
+    """Drain due jobs whenever woken or every INDEX_WORKER_POLL_SECONDS (body of the worker thread)"""
+    while True:
+        try:
+            while process_index_jobs():
+                pass
+            from modules.vectorstore import prune_embedding_cache_if_due
+            prune_embedding_cache_if_due()
+            index_worker_state["last_error"] = None
+        except Exception as e:
+            # e.g. the database is locked; the jobs stay queued for the next round
+            index_worker_state["last_error"] = str(e)
+
+        index_worker_wakeup.wait(INDEX_WORKER_POLL_SECONDS)
+        index_worker_wakeup.clear()
+
+def claim_index_jobs(limit=INDEX_JOB_BATCH_SIZE):
+    """Mark up to `limit` due jobs as running and return them"""
+    conn = get_db_connection()
+    c = conn.cursor()
+    now = time.time()
+
+    try:
+        # Take the write lock up front so two workers never claim the same jobs
+        c.execute("BEGIN IMMEDIATE")
+        c.execute(
+            "UPDATE index_jobs SET status = 'pending' WHERE status = 'running' AND claimed_at < ?",
+            (now - INDEX_JOB_CLAIM_TIMEOUT_SECONDS,)
+        )
+        c.execute(
+            "SELECT id, item_id, attempts FROM index_jobs WHERE status = 'pending' AND next_attempt <= ? ORDER BY id LIMIT ?",
+            (now, limit)
+        )
+        jobs = [dict(row) for row in c.fetchall()]
+        c.executemany(
+            "UPDATE index_jobs SET status = 'running', claimed_at = ? WHERE id = ?",
+            [(now, job['id']) for job in jobs]
+        )
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+    return jobs
+
+def process_index_jobs(vectorstore=None, limit=INDEX_JOB_BATCH_SIZE):
+    """Claim a batch of due jobs, embed their items together and apply them to the index
+
+    Returns the number of jobs claimed (0 when nothing is due).
+    """
+    from modules.vectorstore import (
+        get_vectorstore, get_embeddings, split_into_chunks, replace_item_vectors, remove_item_vectors
+    )
+
+    jobs = claim_index_jobs(limit)
+    if not jobs:
+        return 0
+
+    # Several jobs for one item (e.g. quick successive edits) need only one pass
+    item_ids = sorted(set(job['item_id'] for job in jobs))
+    errors = {}
+
+    conn = get_db_connection()
+    c = conn.cursor()
+    placeholders = ",".join("?" * len(item_ids))
+    c.execute(f"SELECT id, content FROM knowledge_items WHERE id IN ({placeholders})", item_ids)
+    item_chunks = {row['id']: split_into_chunks(row['content']) for row in c.fetchall()}
+    conn.close()
+
+    try:
+        vectorstore = vectorstore or get_vectorstore()
+        embeddings = get_embeddings()
+    except Exception as e:
+        finish_index_jobs(jobs, {item_id: str(e) for item_id in item_ids})
+        raise
+
+    # Embed every item of the batch in one call; if that fails, embed item by item
+    # so one bad item does not hold back the rest
+    all_chunks = [chunk for item_id in item_ids for chunk in item_chunks.get(item_id, [])]
+    try:
+        all_vectors = embeddings.encode(all_chunks) if all_chunks else []
+    except Exception:
+        all_vectors = None
+
+    start = 0
+    for item_id in item_ids:
+        try:
+            if item_id not in item_chunks:
+                remove_item_vectors(vectorstore, item_id)
+                continue
+
+            chunks = item_chunks[item_id]
+            if all_vectors is not None:
+                vectors = all_vectors[start:start + len(chunks)]
+            else:
+                vectors = embeddings.encode(chunks)
+            replace_item_vectors(vectorstore, item_id, vectors)
+        except Exception as e:
+            errors[item_id] = str(e)
+        finally:
+            start += len(item_chunks.get(item_id, []))
+
+    finish_index_jobs(jobs, errors)
+
+    # Related-item lists only read stored vectors, so a failure here leaves the jobs done
+    try:
+        from modules.knowledge import refresh_related_items
+
+        refresh_related_items([item_id for item_id in item_ids if item_id not in errors], vectorstore)
+    except Exception as e:
+        index_worker_state["last_error"] = f"Related items not refreshed: {e}"
+    return len(jobs)
+
+def finish_index_jobs(jobs, errors):
+    """Delete succeeded jobs and flag their items indexed; reschedule failed ones with backoff
+
+    `errors` maps item id -> error message for items that could not be indexed.
+    """
+    conn = get_db_connection()
+    c = conn.cursor()
+    now = time.time()
+
+    for job in jobs:
+        error = errors.get(job['item_id'])
+        if error is None:
+            c.execute("DELETE FROM index_jobs WHERE id = ?", (job['id'],))
+            continue
+
+        attempts = job['attempts'] + 1
+        delay = min(INDEX_JOB_RETRY_BASE_SECONDS * 2 ** (attempts - 1), INDEX_JOB_RETRY_MAX_SECONDS)
+        status = 'failed' if attempts >= INDEX_JOB_MAX_ATTEMPTS else 'pending'
+        c.execute(
+            "UPDATE index_jobs SET status = ?, attempts = ?, next_attempt = ?, claimed_at = NULL, last_error = ? WHERE id = ?",
+            (status, attempts, now + delay, error, job['id'])
+        )
+
+    # The item is indexed now, so earlier jobs that ran out of retries are moot
+    indexed_ids = [item_id for item_id in set(job['item_id'] for job in jobs) if item_id not in errors]
+    c.executemany("DELETE FROM index_jobs WHERE item_id = ? AND status = 'failed'", [(item_id,) for item_id in indexed_ids])
+
+    # An edit saved while this batch was running has its own job; leave the flag until it is done
+    c.executemany(
+        "UPDATE knowledge_items SET vector_indexed = 1 WHERE id = ? "
+        "AND NOT EXISTS (SELECT 1 FROM index_jobs WHERE item_id = ? AND status != 'failed')",
+        [(item_id, item_id) for item_id in indexed_ids]
+    )
+    conn.commit()
+    conn.close()
+
+def get_index_queue_stats():
+    """Job counts by status and the age (seconds) of the oldest pending job"""
+    conn = get_db_connection()
+    c = conn.cursor()
+    c.execute("SELECT status, COUNT(*) FROM index_jobs GROUP BY status")
+    stats = {"pending": 0, "running": 0, "failed": 0}
+    stats.update({row[0]: row[1] for row in c.fetchall()})
+
+    c.execute("SELECT MIN(created_date) FROM index_jobs WHERE status != 'failed'")
+    oldest = c.fetchone()[0]
+    conn.close()
+
+    stats["oldest_seconds"] = (
+        (datetime.now() - datetime.strptime(oldest, "%Y-%m-%d %H:%M:%S")).total_seconds() if oldest else 0
+    )
+    stats["last_error"] = index_worker_state["last_error"]
+    return stats
+
+def get_failed_index_jobs(limit=20):
+    """Most recent jobs that ran out of retries, with their last error"""
+    conn = get_db_connection()
+    c = conn.cursor()
+    c.execute(
+        "SELECT j.id, j.item_id, j.attempts, j.last_error, j.created_date, k.title FROM index_jobs j "
+        "LEFT JOIN knowledge_items k ON k.id = j.item_id WHERE j.status = 'failed' ORDER BY j.id DESC LIMIT ?",
+        (limit,)
+    )
+    jobs = [dict(row) for row in c.fetchall()]
+    conn.close()
+    return jobs
+
+def retry_failed_index_jobs():
+    """Put failed jobs back in the queue with a fresh retry budget; returns how many"""
+    conn = get_db_connection()
+    c = conn.cursor()
+    c.execute(
+        "UPDATE index_jobs SET status = 'pending', attempts = 0, next_attempt = ? WHERE status = 'failed'",
+        (time.time(),)
+    )
+    count = c.rowcount
+    conn.commit()
+    conn.close()
+
+    if count:
+        notify_index_worker()
+    return count
@@ -1,12 +1,38 @@
 import os
+import re
+import sys
+import time
 import uuid
+import sqlite3
+import argparse
 from datetime import datetime
-from modules.database import get_db_connection
-from modules.vectorstore import add_to_vectorstore, rebuild_vectorstore
-from config import UPLOAD_FOLDER
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from modules.database import get_db_connection, init_database
+from modules.vectorstore import rebuild_vectorstore, prune_embedding_cache
+from modules.index_queue import enqueue_index_job, notify_index_worker
+from modules.duplicates import (
+    find_near_duplicates, format_duplicate_message, store_item_signature, delete_item_signature
+)
+from config import (
+    UPLOAD_FOLDER, CHUNK_AGGREGATION, CHUNK_FETCH_MULTIPLIER, RELATED_ITEMS_K, CROSS_ENCODER_MODEL, CROSS_ENCODER_CANDIDATES,
+    HYBRID_RRF_K, HYBRID_KEYWORD_BUDGET_MS, HYBRID_SEMANTIC_BUDGET_MS, DUPLICATE_ACTION
+)
 
-def add_knowledge_item(title, content, category, tags, author_id, uploaded_file=None):
-    """Add a new knowledge item and index it in vector store"""
+# Runs the keyword and semantic legs of hybrid search side by side
+search_executor = ThreadPoolExecutor(max_workers=4)
+
+def add_knowledge_item(title, content, category, tags, author_id, uploaded_file=None, allow_duplicate=False):
+    """Add a new knowledge item and queue it for vector indexing
+    
+    Content that near-duplicates an existing item is not saved (nor its file
+    stored or its text embedded) unless DUPLICATE_ACTION is "warn" and the
+    caller passes allow_duplicate=True after showing the warning.
+    """
+    if DUPLICATE_ACTION and not (DUPLICATE_ACTION == "warn" and allow_duplicate):
+        duplicates = find_near_duplicates(content)
+        if duplicates:
+            return False, f"Near-duplicate of {format_duplicate_message(duplicates)}"
+    
     conn = get_db_connection()
     c = conn.cursor()
     current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
@@ -22,19 +48,17 @@ def add_knowledge_item(title, content, category, tags, author_id, uploaded_file=
             "INSERT INTO knowledge_items (title, content, category, tags, created_date, last_updated, author_id, file_path, vector_indexed) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
             (title, content, category, tags, current_time, current_time, author_id, file_path, 0)
         )
-        conn.commit()
         
         # Get the ID of the newly inserted item
         c.execute("SELECT last_insert_rowid()")
         doc_id = c.fetchone()[0]
+        store_item_signature(c, doc_id, content)
         
-        # Add to vector store
-        add_to_vectorstore(doc_id, title, content, category, tags)
-        
-        # Update indexed status
-        c.execute("UPDATE knowledge_items SET vector_indexed = 1 WHERE id = ?", (doc_id,))
+        # Queue it for embedding; the background worker sets vector_indexed once it is in the index
+        enqueue_index_job(c, doc_id)
         conn.commit()
         conn.close()
+        notify_index_worker()
         
         return True, doc_id
     except Exception as e:
@@ -42,7 +66,7 @@ def add_knowledge_item(title, content, category, tags, author_id, uploaded_file=
         return False, str(e)
 
 def update_knowledge_item(item_id, title, content, category, tags, uploaded_file=None):
-    """Update an existing knowledge item and reindex it"""
+    """Update an existing knowledge item and queue it for reindexing"""
     conn = get_db_connection()
     c = conn.cursor()
     current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
@@ -75,15 +99,13 @@ def update_knowledge_item(item_id, title, content, category, tags, uploaded_file
                 "UPDATE knowledge_items SET title=?, content=?, category=?, tags=?, last_updated=?, vector_indexed=? WHERE id=?",
                 (title, content, category, tags, current_time, 0, item_id)
             )
-        conn.commit()
-        
-        # Update vector store
-        add_to_vectorstore(item_id, title, content, category, tags)
+        store_item_signature(c, item_id, content)
         
-        # Update indexed status
-        c.execute("UPDATE knowledge_items SET vector_indexed = 1 WHERE id = ?", (item_id,))
+        # The worker replaces the item's vectors in the vector store
+        enqueue_index_job(c, item_id)
         conn.commit()
         conn.close()
+        notify_index_worker()
         
         return True, "Knowledge item updated successfully"
     except Exception as e:
@@ -91,7 +113,7 @@ def update_knowledge_item(item_id, title, content, category, tags, uploaded_file
         return False, str(e)
 
 def delete_knowledge_item(item_id):
-    """Delete a knowledge item and rebuild the vector store"""
+    """Delete a knowledge item and queue removal of its vectors from the vector store"""
     conn = get_db_connection()
     c = conn.cursor()
     
@@ -107,21 +129,202 @@ def delete_knowledge_item(item_id):
         
         # Delete from database
         c.execute("DELETE FROM knowledge_items WHERE id = ?", (item_id,))
+        delete_item_signature(c, item_id)
+        
+        # The worker removes only this item's vectors from the vector store
+        enqueue_index_job(c, item_id)
         conn.commit()
+        conn.close()
+        notify_index_worker()
         
-        # Get all remaining items to rebuild vector store
-        c.execute("SELECT id, title, content, category, tags FROM knowledge_items")
-        all_items = [dict(row) for row in c.fetchall()]
+        return True, "Knowledge item deleted successfully"
+    except Exception as e:
         conn.close()
+        return False, str(e)
+
+def reindex_all_knowledge_items(progress_callback=None):
+    """Re-embed every knowledge item into a fresh vector store"""
+    conn = get_db_connection()
+    c = conn.cursor()
+    
+    try:
+        indexed_ids = rebuild_vectorstore(progress_callback)
         
-        # Rebuild vector store
-        rebuild_vectorstore(all_items)
+        # Items edited while the rebuild ran are flagged by the worker once their job is done
+        c.executemany(
+            "UPDATE knowledge_items SET vector_indexed = 1 WHERE id = ? AND NOT EXISTS (SELECT 1 FROM index_jobs WHERE item_id = ? AND status != 'failed')",
+            [(doc_id, doc_id) for doc_id in indexed_ids]
+        )
+        conn.commit()
+        conn.close()
         
-        return True, "Knowledge item deleted successfully"
+        # Passage vectors are all cached now, so this only runs index searches
+        rebuild_related_items()
+        
+        # Drop vectors of passages (or models) the rebuilt index no longer uses
+        prune_embedding_cache()
+        
+        return True, f"Re-indexed {len(indexed_ids)} knowledge items"
+    except Exception as e:
+        conn.close()
+        return False, str(e)
+
+def check_index_consistency(vectorstore=None):
+    """Compare the knowledge items in SQLite with what the vector index holds
+    
+    Lists items with no vectors ("missing"), vectors of items that no longer
+    exist ("orphaned"), items with a chunk indexed more than once ("duplicates"),
+    items whose indexed passages no longer match their content ("stale") and
+    items whose vector_indexed flag is wrong ("flag_mismatches"); "row_mismatch"
+    is set when the FAISS row count disagrees with the vector id map. Items
+    still waiting in the indexing queue ("queued") are not reported.
+    """
+    from modules.vectorstore import get_vectorstore, get_embeddings, split_into_chunks, vectorstore_lock, sync_vectorstore
+    from modules.embeddings import text_hash, find_cached_hashes
+    
+    vectorstore = vectorstore or get_vectorstore()
+    sync_vectorstore(vectorstore)
+    conn = get_db_connection()
+    c = conn.cursor()
+    
+    c.execute("SELECT id, content, vector_indexed FROM knowledge_items")
+    items = {row['id']: dict(row) for row in c.fetchall()}
+    
+    # The worker will bring these in line; only jobs that ran out of retries are a problem
+    c.execute("SELECT DISTINCT item_id FROM index_jobs WHERE status != 'failed'")
+    queued = set(row[0] for row in c.fetchall())
+    for doc_id in queued:
+        items.pop(doc_id, None)
+    
+    with vectorstore_lock:
+        indexed_chunks = {}
+        for doc_id, chunk in vectorstore.chunks.values():
+            if doc_id not in queued:
+                indexed_chunks.setdefault(doc_id, []).append(chunk)
+        vector_count = len(vectorstore)
+        index_rows = vectorstore.count_index_rows()
+    
+    # Indexed text is never stored, but every embedded passage is in the embedding
+    # cache, so a passage without a cache entry was changed after indexing
+    item_hashes = {
+        doc_id: [text_hash(chunk) for chunk in split_into_chunks(item['content'])]
+        for doc_id, item in items.items()
+    }
+    cached = find_cached_hashes(
+        conn, set(digest for hashes in item_hashes.values() for digest in hashes), get_embeddings().cache_name
+    )
+    conn.close()
+    
+    missing = sorted(doc_id for doc_id in items if doc_id not in indexed_chunks)
+    orphaned = sorted(doc_id for doc_id in indexed_chunks if doc_id not in items)
+    duplicates = sorted(
+        doc_id for doc_id, chunks in indexed_chunks.items()
+        if doc_id in items and len(chunks) != len(set(chunks))
+    )
+    stale = sorted(
+        doc_id for doc_id, chunks in indexed_chunks.items()
+        if doc_id in items and doc_id not in duplicates and (
+            sorted(chunks) != list(range(len(item_hashes[doc_id])))
+            or any(digest not in cached for digest in item_hashes[doc_id])
+        )
+    )
+    flag_mismatches = sorted(
+        doc_id for doc_id, item in items.items()
+        if bool(item['vector_indexed']) != (doc_id in indexed_chunks)
+    )
+    
+    return {
+        "items": len(items),
+        "queued": len(queued),
+        "vectors": vector_count,
+        "index_rows": index_rows,
+        "missing": missing,
+        "orphaned": orphaned,
+        "duplicates": duplicates,
+        "stale": stale,
+        "flag_mismatches": flag_mismatches,
+        "row_mismatch": index_rows != vector_count,
+        "ok": not (missing or orphaned or duplicates or stale or flag_mismatches or index_rows != vector_count)
+    }
+
+def repair_index_consistency(report=None, vectorstore=None, progress_callback=None):
+    """Fix what check_index_consistency() found, re-embedding only the affected items
+    
+    Orphaned vectors are removed, missing, duplicated and stale items are
+    re-indexed (unchanged passages come from the embedding cache), the index is
+    rebuilt only if its row count is off, and vector_indexed flags are reset
+    to match the index.
+    """
+    from modules.vectorstore import (
+        get_vectorstore, get_embeddings, split_into_chunks, vectorstore_lock, index_lock,
+        sync_vectorstore, replace_item_vectors, remove_item_vectors, compact_vectorstore
+    )
+    
+    vectorstore = vectorstore or get_vectorstore()
+    report = report or check_index_consistency(vectorstore)
+    conn = get_db_connection()
+    c = conn.cursor()
+    
+    try:
+        for doc_id in report["orphaned"]:
+            remove_item_vectors(vectorstore, doc_id)
+        
+        doc_ids = sorted(set(report["missing"]) | set(report["duplicates"]) | set(report["stale"]))
+        texts = []
+        spans = []
+        for start in range(0, len(doc_ids), 500):
+            batch = doc_ids[start:start + 500]
+            placeholders = ",".join("?" * len(batch))
+            c.execute(f"SELECT id, content FROM knowledge_items WHERE id IN ({placeholders})", batch)
+            for row in c.fetchall():
+                chunks = split_into_chunks(row['content'])
+                spans.append((row['id'], len(texts), len(texts) + len(chunks)))
+                texts.extend(chunks)
+        
+        if texts:
+            vectors = get_embeddings().encode(texts, progress_callback=progress_callback)
+            for doc_id, start, end in spans:
+                replace_item_vectors(vectorstore, doc_id, vectors[start:end])
+        
+        if report["row_mismatch"]:
+            with index_lock():
+                sync_vectorstore(vectorstore)
+                vectorstore.rebuild_index()
+                compact_vectorstore(vectorstore)
+        
+        # Flags follow the index, except for queued items, which the worker flags when done
+        with vectorstore_lock:
+            indexed_ids = list(vectorstore.item_vector_ids)
+        c.execute("UPDATE knowledge_items SET vector_indexed = 0 WHERE id NOT IN (SELECT item_id FROM index_jobs WHERE status != 'failed')")
+        c.executemany(
+            "UPDATE knowledge_items SET vector_indexed = 1 WHERE id = ? AND NOT EXISTS (SELECT 1 FROM index_jobs WHERE item_id = ? AND status != 'failed')",
+            [(doc_id, doc_id) for doc_id in indexed_ids]
+        )
+        conn.commit()
+        conn.close()
+        
+        return True, (
+            f"Re-indexed {len(spans)} items, removed vectors of {len(report['orphaned'])} deleted items, "
+            f"fixed {len(report['flag_mismatches'])} index flags"
+            + (" and rebuilt the index" if report["row_mismatch"] else "")
+        )
     except Exception as e:
         conn.close()
         return False, str(e)
 
+def format_consistency_report(report):
+    """Summarise a check_index_consistency() report as text"""
+    lines = [f"{report['items']} knowledge items, {report['vectors']} vectors, {report['index_rows']} index rows, {report['queued']} items queued for indexing"]
+    for key in ("missing", "orphaned", "duplicates", "stale", "flag_mismatches"):
+        ids = report[key]
+        if ids:
+            preview = ", ".join(str(doc_id) for doc_id in ids[:20]) + (" ..." if len(ids) > 20 else "")
+            lines.append(f"{key.replace('_', ' ')}: {len(ids)} ({preview})")
+    if report["row_mismatch"]:
+        lines.append("FAISS row count does not match the vector id map")
+    lines.append("Index is consistent" if report["ok"] else "Index needs repair")
+    return "\n".join(lines)
+
 def get_knowledge_item(item_id):
     """Get a knowledge item by ID with author details"""
     conn = get_db_connection()
@@ -172,22 +375,360 @@ def search_knowledge_items(search_term=None, category=None, limit=None):
     
     return results
 
-def semantic_search_with_details(query, top_k=5):
-    """Perform semantic search and get full item details"""
-    from modules.vectorstore import semantic_search
+def filter_knowledge_item_ids(category=None, tag=None, author_id=None, date_from=None, date_to=None):
+    """Get the ids of knowledge items matching metadata filters (None when no filter is set)
     
-    # Get semantic search results
-    search_results = semantic_search(query, top_k)
+    date_from / date_to are inclusive dates (date objects or "YYYY-MM-DD") on the creation date.
+    """
+    conditions = []
+    params = []
+    
+    if category and category != "All Categories":
+        conditions.append("category = ?")
+        params.append(category)
+    
+    if tag:
+        conditions.append("tags LIKE ?")
+        params.append(f"%{tag.strip()}%")
+    
+    if author_id:
+        conditions.append("author_id = ?")
+        params.append(author_id)
+    
+    if date_from:
+        conditions.append("date(created_date) >= ?")
+        params.append(str(date_from))
+    
+    if date_to:
+        conditions.append("date(created_date) <= ?")
+        params.append(str(date_to))
+    
+    if not conditions:
+        return None
+    
+    conn = get_db_connection()
+    c = conn.cursor()
+    c.execute(f"SELECT id FROM knowledge_items WHERE {' AND '.join(conditions)}", params)
+    item_ids = [row['id'] for row in c.fetchall()]
+    conn.close()
+    
+    return item_ids
+
+def semantic_search_with_details(query, top_k=5, aggregation=CHUNK_AGGREGATION,
+                                 category=None, tag=None, author_id=None, date_from=None, date_to=None,
+                                 rerank=None, min_similarity=None):
+    """Perform semantic search over chunks and collapse the hits into full items
+    
+    Items are ranked by their best passage ("max") or by the summed similarity
+    of all their matching passages ("sum"). Each item carries its best-matching
+    passage under "matched_passage" and that passage's cosine similarity under
+    "similarity"; the returned score is that passage's distance.
+    The metadata filters restrict which items are searched (see filter_knowledge_item_ids).
+    
+    With min_similarity, every item with a passage at least that similar is
+    returned (a FAISS range search), and top_k=None lifts the count limit.
+    
+    With a cross-encoder configured (or rerank=True), the top CROSS_ENCODER_CANDIDATES
+    items are re-ordered by its score, stored as "rerank_score"; items it had no time
+    budget left for keep their vector-search order after the scored ones.
+    """
+    from modules.vectorstore import semantic_search, split_into_chunks, cross_encoder_scores, distance_to_similarity
+    
+    rerank = bool(CROSS_ENCODER_MODEL) if rerank is None else rerank and bool(CROSS_ENCODER_MODEL)
+    limit = max(top_k, CROSS_ENCODER_CANDIDATES) if rerank and top_k is not None else top_k
+    
+    # Filter inside the index scan so a small category still fills the top k
+    item_ids = filter_knowledge_item_ids(category, tag, author_id, date_from, date_to)
+    if item_ids is not None and not item_ids:
+        return []
+    
+    if min_similarity is not None:
+        search_results = semantic_search(query, None, item_ids, min_similarity=min_similarity)
+    else:
+        # Over-fetch chunks so several passages of one item do not crowd out others
+        search_results = semantic_search(query, limit * CHUNK_FETCH_MULTIPLIER, item_ids)
+    
+    # Group chunk hits by parent item, keeping the closest passage
+    hits = {}
+    for doc_id, chunk, score in search_results:
+        hit = hits.setdefault(doc_id, {"score": score, "chunk": chunk, "total": 0.0})
+        if score < hit["score"]:
+            hit["score"] = score
+            hit["chunk"] = chunk
+        hit["total"] += 1 / (1 + score)
+    
+    if aggregation == "sum":
+        ranked = sorted(hits.items(), key=lambda kv: kv[1]["total"], reverse=True)
+    else:
+        ranked = sorted(hits.items(), key=lambda kv: kv[1]["score"])
     
     # Get full details for each result
     detailed_results = []
-    for doc, score in search_results:
-        doc_id = doc.metadata["id"]
+    for doc_id, hit in ranked:
         item = get_knowledge_item(doc_id)
         if item:
-            detailed_results.append((item, score))
+            # The index stores only chunk numbers, so recover the passage from the content
+            chunks = split_into_chunks(item["content"])
+            item["matched_passage"] = chunks[hit["chunk"]] if hit["chunk"] < len(chunks) else None
+            item["similarity"] = distance_to_similarity(hit["score"])
+            detailed_results.append((item, hit["score"]))
+        if limit is not None and len(detailed_results) >= limit:
+            break
     
-    return detailed_results
+    if rerank and detailed_results:
+        passages = [item.get("matched_passage") or item["content"] for item, _ in detailed_results]
+        scores = cross_encoder_scores(query, passages)
+        for (item, _), score in zip(detailed_results, scores):
+            item["rerank_score"] = score
+        scored = [result for result in detailed_results if result[0]["rerank_score"] is not None]
+        unscored = [result for result in detailed_results if result[0]["rerank_score"] is None]
+        scored.sort(key=lambda result: result[0]["rerank_score"], reverse=True)
+        detailed_results = scored + unscored
+    
+    return detailed_results[:top_k]
+
+def keyword_search_ranked(query, limit=20, category=None):
+    """Rank knowledge items for a query by BM25 over title, content and tags
+    
+    Returns (item id, score) pairs, best first. Without FTS5 support the
+    items come from the LIKE scan of search_knowledge_items and have no score.
+    """
+    terms = re.findall(r"\w+", query)
+    if not terms:
+        return []
+    
+    conn = get_db_connection()
+    c = conn.cursor()
+    
+    # Quote each term so user input cannot inject FTS5 query syntax
+    sql = """
+    SELECT k.id, bm25(knowledge_fts) AS rank
+    FROM knowledge_fts
+    JOIN knowledge_items k ON k.id = knowledge_fts.rowid
+    WHERE knowledge_fts MATCH ?
+    """
+    params = [" OR ".join(f'"{term}"' for term in terms)]
+    
+    if category and category != "All Categories":
+        sql += " AND k.category = ?"
+        params.append(category)
+    
+    sql += " ORDER BY rank LIMIT ?"
+    params.append(limit)
+    
+    try:
+        c.execute(sql, params)
+        # bm25() is lower for better matches; flip it so higher is better
+        results = [(row['id'], -row['rank']) for row in c.fetchall()]
+    except sqlite3.OperationalError:
+        results = [(item['id'], None) for item in search_knowledge_items(query, category, limit)]
+    conn.close()
+    
+    return results
+
+def hybrid_search(query, top_k=5, category=None):
+    """Run keyword and semantic search concurrently and fuse them with reciprocal-rank fusion
+    
+    Each leg has its own latency budget; a leg that misses it is left out and
+    reported as timed out. Returns (results, legs): results are (item, fused score)
+    pairs where each item carries its per-source ranks and scores under
+    "hybrid_scores", and legs maps "keyword" / "semantic" to
+    {"ms": elapsed, "timed_out": bool, "error": message or None}.
+    """
+    candidates = top_k * CHUNK_FETCH_MULTIPLIER
+    started = time.perf_counter()
+    futures = {
+        "keyword": search_executor.submit(keyword_search_ranked, query, candidates, category),
+        "semantic": search_executor.submit(semantic_search_with_details, query, candidates, category=category)
+    }
+    budgets = {"keyword": HYBRID_KEYWORD_BUDGET_MS, "semantic": HYBRID_SEMANTIC_BUDGET_MS}
+    
+    rankings = {}
+    legs = {}
+    for leg, future in futures.items():
+        # Budgets are measured from the start, since both legs run at once
+        remaining = budgets[leg] / 1000 - (time.perf_counter() - started)
+        leg_stats = {"ms": None, "timed_out": False, "error": None}
+        try:
+            rankings[leg] = future.result(timeout=max(remaining, 0))
+        except FutureTimeoutError:
+            leg_stats["timed_out"] = True
+        except Exception as e:
+            leg_stats["error"] = str(e)
+        leg_stats["ms"] = (time.perf_counter() - started) * 1000
+        legs[leg] = leg_stats
+    
+    fused = {}
+    items = {}
+    for rank, (doc_id, score) in enumerate(rankings.get("keyword", []), start=1):
+        entry = fused.setdefault(doc_id, {"rrf": 0.0})
+        entry["rrf"] += 1 / (HYBRID_RRF_K + rank)
+        entry["keyword_rank"] = rank
+        entry["keyword_score"] = score
+    for rank, (item, distance) in enumerate(rankings.get("semantic", []), start=1):
+        entry = fused.setdefault(item["id"], {"rrf": 0.0})
+        entry["rrf"] += 1 / (HYBRID_RRF_K + rank)
+        entry["semantic_rank"] = rank
+        entry["semantic_distance"] = distance
+        entry["semantic_similarity"] = item["similarity"]
+        items[item["id"]] = item
+    
+    results = []
+    for doc_id, scores in sorted(fused.items(), key=lambda kv: kv[1]["rrf"], reverse=True):
+        item = items.get(doc_id) or get_knowledge_item(doc_id)
+        if item:
+            item["hybrid_scores"] = scores
+            results.append((item, scores["rrf"]))
+        if len(results) >= top_k:
+            break
+    
+    return results, legs
+
+def get_related_items(item_id, limit=RELATED_ITEMS_K):
+    """Get an item's precomputed related items as (item, distance) pairs, closest first"""
+    conn = get_db_connection()
+    c = conn.cursor()
+    
+    c.execute("""
+    SELECT k.*, r.distance
+    FROM related_items r
+    JOIN knowledge_items k ON k.id = r.related_id
+    WHERE r.item_id = ?
+    ORDER BY r.rank
+    LIMIT ?
+    """, (item_id, limit))
+    
+    results = []
+    for row in c.fetchall():
+        item = dict(row)
+        results.append((item, item.pop('distance')))
+    conn.close()
+    
+    return results
+
+def compute_related_items(item_ids, vectorstore=None, k=RELATED_ITEMS_K):
+    """Find the k nearest other items of each item, as {item id: [(related id, distance), ...]}
+    
+    Each item's passage vectors are read from the embedding cache that indexing
+    filled and searched against the index, so no text is re-encoded; items whose
+    passages are not all cached are skipped. The distance between two items is
+    that of their closest pair of passages.
+    """
+    from modules.vectorstore import get_vectorstore, get_embeddings, split_into_chunks
+    from modules.embeddings import text_hash, load_cached_embeddings
+    
+    vectorstore = vectorstore or get_vectorstore()
+    item_ids = list(item_ids)
+    conn = get_db_connection()
+    c = conn.cursor()
+    
+    item_hashes = {}
+    for start in range(0, len(item_ids), 500):
+        batch = item_ids[start:start + 500]
+        placeholders = ",".join("?" * len(batch))
+        c.execute(f"SELECT id, content FROM knowledge_items WHERE id IN ({placeholders})", batch)
+        for row in c.fetchall():
+            item_hashes[row['id']] = [text_hash(chunk) for chunk in split_into_chunks(row['content'])]
+    
+    cached = load_cached_embeddings(
+        conn, set(digest for hashes in item_hashes.values() for digest in hashes), get_embeddings().cache_name
+    )
+    conn.close()
+    
+    owners = []
+    vectors = []
+    for doc_id, hashes in item_hashes.items():
+        if all(digest in cached for digest in hashes):
+            owners.extend([doc_id] * len(hashes))
+            vectors.extend(cached[digest] for digest in hashes)
+    
+    related = {doc_id: {} for doc_id in set(owners)}
+    # An item's own passages are its nearest hits, so fetch past them
+    fetch_k = k * CHUNK_FETCH_MULTIPLIER + max((len(hashes) for hashes in item_hashes.values()), default=0)
+    for start in range(0, len(vectors), 256):
+        batch_results = vectorstore.search_batch(vectors[start:start + 256], fetch_k)
+        for owner, hits in zip(owners[start:start + 256], batch_results):
+            neighbours = related[owner]
+            for doc_id, _, distance in hits:
+                if doc_id != owner and distance < neighbours.get(doc_id, float("inf")):
+                    neighbours[doc_id] = distance
+    
+    return {
+        doc_id: sorted(neighbours.items(), key=lambda neighbour: neighbour[1])[:k]
+        for doc_id, neighbours in related.items()
+    }
+
+def store_related_items(c, related):
+    """Replace the stored related-item lists of the items in {item id: [(related id, distance), ...]}"""
+    c.executemany("DELETE FROM related_items WHERE item_id = ?", [(doc_id,) for doc_id in related])
+    c.executemany(
+        "INSERT INTO related_items (item_id, related_id, rank, distance) VALUES (?, ?, ?, ?)",
+        [
+            (doc_id, related_id, rank, float(distance))
+            for doc_id, neighbours in related.items()
+            for rank, (related_id, distance) in enumerate(neighbours)
+        ]
+    )
+
+def refresh_related_items(item_ids, vectorstore=None, k=RELATED_ITEMS_K):
+    """Update related-item lists after items were indexed, edited or deleted
+    
+    The changed items get fresh lists, lists that mention a changed item are
+    recomputed (that neighbour moved or is gone), and each changed item is
+    merged into the existing lists of its new neighbours.
+    """
+    item_ids = list(item_ids)
+    if not item_ids:
+        return 0
+    
+    conn = get_db_connection()
+    c = conn.cursor()
+    placeholders = ",".join("?" * len(item_ids))
+    c.execute(f"SELECT DISTINCT item_id FROM related_items WHERE related_id IN ({placeholders})", item_ids)
+    referencing = set(row['item_id'] for row in c.fetchall())
+    c.execute(f"SELECT id FROM knowledge_items WHERE id IN ({placeholders})", item_ids)
+    existing = set(row['id'] for row in c.fetchall())
+    c.execute(f"DELETE FROM related_items WHERE item_id IN ({placeholders})", item_ids)
+    conn.commit()
+    
+    related = compute_related_items(existing | referencing, vectorstore, k)
+    
+    for doc_id in existing:
+        for neighbour, distance in related.get(doc_id, []):
+            if neighbour in related:
+                continue
+            c.execute("SELECT related_id, distance FROM related_items WHERE item_id = ? ORDER BY rank", (neighbour,))
+            current = [(row['related_id'], row['distance']) for row in c.fetchall()]
+            # Lists that were never computed are left to rebuild_related_items()
+            if current:
+                merged = [entry for entry in current if entry[0] != doc_id] + [(doc_id, distance)]
+                related[neighbour] = sorted(merged, key=lambda entry: entry[1])[:k]
+    
+    store_related_items(c, related)
+    conn.commit()
+    conn.close()
+    
+    return len(related)
+
+def rebuild_related_items(vectorstore=None, progress_callback=None):
+    """Recompute every item's related-item list (e.g. for items indexed before the lists existed)"""
+    conn = get_db_connection()
+    c = conn.cursor()
+    c.execute("SELECT id FROM knowledge_items")
+    item_ids = [row['id'] for row in c.fetchall()]
+    
+    related = {}
+    for start in range(0, len(item_ids), 200):
+        related.update(compute_related_items(item_ids[start:start + 200], vectorstore))
+        if progress_callback:
+            progress_callback(min(start + 200, len(item_ids)), len(item_ids))
+    
+    c.execute("DELETE FROM related_items")
+    store_related_items(c, related)
+    conn.commit()
+    conn.close()
+    
+    return len(related)
 
 def get_categories():
     """Get all unique categories"""
@@ -241,4 +782,28 @@ def save_uploaded_file(uploaded_file):
     with open(file_path, "wb") as f:
         f.write(uploaded_file.getbuffer())
         
-    return file_path
\ No newline at end of file
+    return file_path
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check the vector index against the knowledge base")
+    parser.add_argument("command", choices=["check-index", "repair-index"])
+    args = parser.parse_args()
+
+    from modules.vectorstore import pinned_resources, load_embeddings, load_vectorstore
+
+    init_database()
+
+    # st.cache_resource only caches inside a Streamlit app, so pin this process's instances
+    # (as vector_service.serve() does) rather than loading them again on every call
+    pinned_resources["embeddings"] = load_embeddings()
+    pinned_resources["vectorstore"] = vectorstore = load_vectorstore()
+    report = check_index_consistency(vectorstore)
+    print(format_consistency_report(report))
+
+    if args.command == "repair-index" and not report["ok"]:
+        success, message = repair_index_consistency(report, vectorstore)
+        print(message if success else f"Repair failed: {message}")
+        report = check_index_consistency(vectorstore)
+        print(format_consistency_report(report))
+
+    sys.exit(0 if report["ok"] else 1)
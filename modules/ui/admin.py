@@ -176,7 +176,10 @@ def show_all_users():
 
 def show_system_stats():
     """Display system statistics with styled metric cards."""
-    from modules.knowledge import get_knowledge_stats
+    from modules.knowledge import (
+        get_knowledge_stats, reindex_all_knowledge_items,
+        check_index_consistency, repair_index_consistency, format_consistency_report, rebuild_related_items
+    )
     from modules.database import get_db_connection
 
     knowledge_stats = get_knowledge_stats()
@@ -209,4 +212,168 @@ def show_system_stats():
     with col2:
         st.markdown(render_metric_card("⏳", pending_users, "Pending"), unsafe_allow_html=True)
     with col3:
-        st.markdown(render_metric_card("🛡️", admin_users, "Administrators"), unsafe_allow_html=True)
\ No newline at end of file
+        st.markdown(render_metric_card("🛡️", admin_users, "Administrators"), unsafe_allow_html=True)
+
+    st.markdown("<br>", unsafe_allow_html=True)
+
+    st.markdown("### 🧠 Vector Index")
+    from modules.vectorstore import get_query_cache_stats, get_query_batch_stats, get_cross_encoder_stats
+
+    query_cache = get_query_cache_stats()
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        st.markdown(render_metric_card("⚡", f"{query_cache['hit_rate']:.0%}", "Query Cache Hit Rate"), unsafe_allow_html=True)
+    with col2:
+        st.markdown(render_metric_card("✅", query_cache["hits"], "Query Cache Hits"), unsafe_allow_html=True)
+    with col3:
+        st.markdown(render_metric_card("🧮", query_cache["misses"], "Query Cache Misses"), unsafe_allow_html=True)
+
+    query_batches = get_query_batch_stats()
+    if query_batches["batches"]:
+        st.caption(
+            f"Concurrent semantic searches are batched: {query_batches['queries']} searches in "
+            f"{query_batches['batches']} batches ({query_batches['avg_size']:.1f} per batch)"
+        )
+
+    rerank_stats = get_cross_encoder_stats()
+    if rerank_stats["queries"]:
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            st.markdown(render_metric_card("⏱️", f"{rerank_stats['avg_ms']:.0f} ms", "Re-rank Time / Query"), unsafe_allow_html=True)
+        with col2:
+            scored_rate = rerank_stats["scored"] / rerank_stats["candidates"] if rerank_stats["candidates"] else 0.0
+            st.markdown(render_metric_card("📊", f"{scored_rate:.0%}", "Candidates Re-ranked"), unsafe_allow_html=True)
+        with col3:
+            st.markdown(render_metric_card("🔀", f"{rerank_stats['reordered_rate']:.0%}", "Top Result Changed"), unsafe_allow_html=True)
+
+    from modules.index_queue import get_index_queue_stats, get_failed_index_jobs, retry_failed_index_jobs
+
+    queue_stats = get_index_queue_stats()
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        st.markdown(render_metric_card("📥", queue_stats["pending"] + queue_stats["running"], "Waiting To Be Indexed"), unsafe_allow_html=True)
+    with col2:
+        st.markdown(render_metric_card("⌛", f"{queue_stats['oldest_seconds']:.0f} s", "Oldest Queued Job"), unsafe_allow_html=True)
+    with col3:
+        st.markdown(render_metric_card("❌", queue_stats["failed"], "Failed Index Jobs"), unsafe_allow_html=True)
+
+    if queue_stats["last_error"]:
+        st.warning(f"Indexing worker error: {queue_stats['last_error']}")
+
+    if queue_stats["failed"]:
+        failed_jobs = get_failed_index_jobs()
+        st.dataframe(
+            pd.DataFrame(failed_jobs)[["item_id", "title", "attempts", "last_error", "created_date"]],
+            use_container_width=True, hide_index=True
+        )
+        if st.button("🔁 Retry Failed Index Jobs", use_container_width=True):
+            count = retry_failed_index_jobs()
+            st.success(f"✅ Re-queued {count} index jobs")
+
+    if st.button("🔄 Rebuild Vector Index", use_container_width=True):
+        progress = st.progress(0)
+        status = st.empty()
+
+        def on_progress(done, total):
+            progress.progress(done / total)
+            status.text(f"🧠 Embedding passages: {done} / {total}")
+
+        with st.spinner("Rebuilding vector index..."):
+            success, message = reindex_all_knowledge_items(on_progress)
+
+        if success:
+            progress.progress(100)
+            status.success(f"✅ {message}")
+        else:
+            progress.empty()
+            status.error(f"❌ Failed to rebuild index: {message}")
+
+    if st.button("🔗 Rebuild Related Items", use_container_width=True):
+        progress = st.progress(0)
+        status = st.empty()
+
+        def on_related_progress(done, total):
+            progress.progress(done / total)
+            status.text(f"🔗 Finding related items: {done} / {total}")
+
+        with st.spinner("Rebuilding related items..."):
+            count = rebuild_related_items(progress_callback=on_related_progress)
+
+        progress.progress(100)
+        status.success(f"✅ Related items computed for {count} knowledge items")
+
+    if st.button("🎯 Measure Index Recall", use_container_width=True):
+        from modules.vectorstore import evaluate_index_recall
+
+        with st.spinner("Comparing the index against exact search..."):
+            report = evaluate_index_recall()
+
+        if report:
+            col1, col2, col3 = st.columns(3)
+            with col1:
+                st.markdown(render_metric_card("🎯", f"{report['recall']:.1%}", f"Recall@{report['k']}"), unsafe_allow_html=True)
+            with col2:
+                st.markdown(render_metric_card("🗂️", f"{report['index_type']} / {report['quantization']} / {report['metric']} / {report['dimension']}d", "Index / Encoding / Metric / Dims"), unsafe_allow_html=True)
+            with col3:
+                st.markdown(render_metric_card("💾", f"{report['index_bytes'] / 1024 / 1024:.1f} MB", "Index Memory"), unsafe_allow_html=True)
+        else:
+            st.info("The vector index is empty")
+
+    if st.button("📉 Compare Reduced Dimensions", use_container_width=True):
+        from modules.vectorstore import evaluate_reduction_tradeoff
+
+        with st.spinner("Indexing the corpus at each dimension and measuring recall..."):
+            rows = evaluate_reduction_tradeoff()
+
+        if rows:
+            st.dataframe(pd.DataFrame([
+                {
+                    "Dimensions": row["dimension"],
+                    "Reduction": row["reduction"],
+                    "Index Recall@10": f"{row['index_recall']:.1%}",
+                    "Recall@10 (re-ranked)": f"{row['recall']:.1%}",
+                    "Index ms / query": f"{row['ms_per_query']:.3f}",
+                    "Index MB": f"{row['index_bytes'] / 1024 / 1024:.1f}"
+                }
+                for row in rows
+            ]), use_container_width=True, hide_index=True)
+            st.caption("Set INDEX_REDUCTION and INDEX_REDUCED_DIM in config.py to index at a reduced dimension.")
+        else:
+            st.info("The vector index is empty")
+
+    # The report is kept in the session so the repair button survives the rerun
+    if st.button("🩺 Check Index Consistency", use_container_width=True):
+        with st.spinner("Comparing the vector index with the database..."):
+            st.session_state['index_report'] = check_index_consistency()
+
+    report = st.session_state.get('index_report')
+    if report:
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            st.markdown(render_metric_card("❓", len(report["missing"]) + len(report["stale"]), "Missing / Stale Items"), unsafe_allow_html=True)
+        with col2:
+            st.markdown(render_metric_card("👻", len(report["orphaned"]) + len(report["duplicates"]), "Orphaned / Duplicate"), unsafe_allow_html=True)
+        with col3:
+            st.markdown(render_metric_card("🏷️", len(report["flag_mismatches"]), "Wrong Index Flags"), unsafe_allow_html=True)
+
+        if report["ok"]:
+            st.success("✅ Vector index and database are consistent")
+        else:
+            st.code(format_consistency_report(report), language=None)
+            if st.button("🛠️ Repair Index", use_container_width=True):
+                progress = st.progress(0)
+                status = st.empty()
+
+                def on_repair_progress(done, total):
+                    progress.progress(done / total)
+                    status.text(f"🧠 Embedding passages: {done} / {total}")
+
+                with st.spinner("Repairing vector index..."):
+                    success, message = repair_index_consistency(report, progress_callback=on_repair_progress)
+
+                progress.empty()
+                if success:
+                    st.session_state['index_report'] = check_index_consistency()
+                    status.success(f"✅ {message}")
+                else:
+                    status.error(f"❌ Repair failed: {message}")
@@ -10,11 +10,26 @@ from modules.knowledge import (
     search_knowledge_items,
     get_categories
 )
-from modules.vectorstore import add_to_vectorstore
 from modules.ui.styles import (
     inject_global_css, render_page_header, render_knowledge_card,
     render_empty_state, render_badge
 )
+from modules.ui.search import display_related_items
+from modules.duplicates import find_near_duplicates, format_duplicate_message
+from config import DUPLICATE_ACTION
+
+DUPLICATE_CHECKBOX_LABEL = "Save even if a near-duplicate already exists"
+
+
+def warn_near_duplicates(content):
+    """Name the items the content near-duplicates and how to save it anyway; True if there are any"""
+    duplicates = find_near_duplicates(content)
+    if duplicates:
+        st.warning(
+            f"⚠️ Not saved: this looks like a near-duplicate of {format_duplicate_message(duplicates)}. "
+            f"Tick \"{DUPLICATE_CHECKBOX_LABEL}\" and save again to keep it anyway."
+        )
+    return bool(duplicates)
 
 
 def show_add_knowledge_page(conn):
@@ -61,6 +76,10 @@ def show_manual_entry_form(conn):
             type=["pdf", "docx", "xlsx", "txt", "jpg", "png", "jpeg"]
         )
 
+        allow_duplicate = False
+        if DUPLICATE_ACTION == "warn":
+            allow_duplicate = st.checkbox(DUPLICATE_CHECKBOX_LABEL)
+
         submit_button = st.form_submit_button("💾 Save Knowledge", use_container_width=True)
 
     if submit_button:
@@ -68,33 +87,25 @@ def show_manual_entry_form(conn):
             st.error("❌ Title, Content and Category are required")
             return
 
-        with st.spinner("Saving and indexing knowledge..."):
-            progress = st.progress(0)
-            status_text = st.empty()
-
-            status_text.text("📝 Saving content...")
-            progress.progress(30)
-            time.sleep(0.3)
-
-            status_text.text("🧠 Creating vector embeddings...")
-            progress.progress(60)
-            time.sleep(0.3)
-
-            status_text.text("📊 Updating vector database...")
-            progress.progress(90)
-            time.sleep(0.3)
+        # Checked here so the warning can name the matches; once it passes, saving need not check again
+        if DUPLICATE_ACTION == "warn" and not allow_duplicate:
+            if warn_near_duplicates(content):
+                return
+            allow_duplicate = True
 
+        # Embedding happens in the background indexing worker, so saving returns straight away
+        with st.spinner("Saving knowledge..."):
             author_id = st.session_state['user_id']
-            success, result = add_knowledge_item(title, content, category, tags, author_id, uploaded_file)
+            success, result = add_knowledge_item(
+                title, content, category, tags, author_id, uploaded_file, allow_duplicate=allow_duplicate
+            )
 
-            if success:
-                progress.progress(100)
-                status_text.success("✅ Knowledge Added Successfully!")
-                time.sleep(1)
-                st.rerun()
-            else:
-                progress.empty()
-                st.error(f"❌ Failed to add knowledge: {result}")
+        if success:
+            st.success("✅ Knowledge Added Successfully! It will appear in semantic search once indexing finishes.")
+            time.sleep(1)
+            st.rerun()
+        else:
+            st.error(f"❌ Failed to add knowledge: {result}")
 
 
 def show_ocr_extraction_form(conn):
@@ -259,6 +270,9 @@ def show_ocr_extraction_form(conn):
                 tags = st.text_input("🏷️ Tags", key="ocr_tags", placeholder="tag1, tag2, tag3")
 
             keep_original = st.checkbox("📎 Attach original file", value=True)
+            allow_duplicate = False
+            if DUPLICATE_ACTION == "warn":
+                allow_duplicate = st.checkbox(DUPLICATE_CHECKBOX_LABEL, key="ocr_allow_duplicate")
             submit_ocr = st.form_submit_button("💾 Save Knowledge", use_container_width=True)
 
         if submit_ocr:
@@ -266,30 +280,24 @@ def show_ocr_extraction_form(conn):
                 st.error("❌ Title, Content and Category are required")
                 return
 
-            with st.spinner("Saving extracted knowledge..."):
-                save_progress = st.progress(0)
-                save_status = st.empty()
-
-                save_status.text("📝 Processing content...")
-                save_progress.progress(30)
-                time.sleep(0.3)
-
-                save_status.text("🧠 Creating vector embeddings...")
-                save_progress.progress(60)
-                time.sleep(0.3)
+            if DUPLICATE_ACTION == "warn" and not allow_duplicate:
+                if warn_near_duplicates(content):
+                    return
+                allow_duplicate = True
 
+            with st.spinner("Saving extracted knowledge..."):
                 file_to_attach = uploaded_ocr_file if keep_original else None
                 author_id = st.session_state['user_id']
-                success, result = add_knowledge_item(title, content, category, tags, author_id, file_to_attach)
+                success, result = add_knowledge_item(
+                    title, content, category, tags, author_id, file_to_attach, allow_duplicate=allow_duplicate
+                )
 
-                if success:
-                    save_progress.progress(100)
-                    save_status.success("✅ Knowledge Added Successfully!")
-                    time.sleep(1)
-                    st.rerun()
-                else:
-                    save_progress.empty()
-                    st.error(f"❌ Failed to add knowledge: {result}")
+            if success:
+                st.success("✅ Knowledge Added Successfully! It will appear in semantic search once indexing finishes.")
+                time.sleep(1)
+                st.rerun()
+            else:
+                st.error(f"❌ Failed to add knowledge: {result}")
 
 
 def show_manage_knowledge_page():
@@ -397,6 +405,8 @@ def show_edit_form():
         with col2:
             delete_button = st.form_submit_button("🗑️ Delete", use_container_width=True)
 
+    display_related_items(st.session_state["edit_id"])
+
     if update_button:
         if not edit_title or not edit_content or not edit_category:
             st.error("❌ Title, Content and Category are required")
@@ -407,12 +417,7 @@ def show_edit_form():
             status = st.empty()
 
             status.text("📝 Updating content...")
-            progress.progress(30)
-            time.sleep(0.3)
-
-            status.text("🧠 Updating embeddings...")
-            progress.progress(60)
-            time.sleep(0.3)
+            progress.progress(50)
 
             success, message = update_knowledge_item(
                 st.session_state["edit_id"],
@@ -421,7 +426,7 @@ def show_edit_form():
 
             if success:
                 progress.progress(100)
-                status.success("✅ Knowledge Updated Successfully!")
+                status.success("✅ Knowledge Updated Successfully! Search results will reflect it once reindexing finishes.")
                 for key in list(st.session_state.keys()):
                     if key.startswith("edit_"):
                         del st.session_state[key]
@@ -436,12 +441,7 @@ def show_edit_form():
             status = st.empty()
 
             status.text("🗑️ Removing entry...")
-            progress.progress(40)
-            time.sleep(0.3)
-
-            status.text("🔄 Rebuilding vector index...")
-            progress.progress(70)
-            time.sleep(0.3)
+            progress.progress(50)
 
             success, message = delete_knowledge_item(st.session_state["edit_id"])
 
@@ -1,12 +1,15 @@
 import streamlit as st
 import os
 import time
-from modules.knowledge import search_knowledge_items, semantic_search_with_details, get_categories
+from modules.knowledge import (
+    search_knowledge_items, semantic_search_with_details, hybrid_search, get_categories, get_related_items
+)
+from modules.vectorstore import get_warmup_status, distance_to_similarity
 from modules.ui.styles import (
     inject_global_css, render_page_header, render_knowledge_card,
     render_empty_state, render_badge, render_score_bar
 )
-from config import DEFAULT_TOP_K
+from config import DEFAULT_TOP_K, HYBRID_KEYWORD_BUDGET_MS, HYBRID_SEMANTIC_BUDGET_MS, SEMANTIC_MIN_SIMILARITY
 
 
 def show_search_page():
@@ -15,12 +18,12 @@ def show_search_page():
 
     render_page_header(
         title="Search Knowledge Base",
-        subtitle="Find information using keywords or AI-powered semantic search",
+        subtitle="Find information using keywords, AI-powered semantic search, or both",
         icon="🔍"
     )
 
     # Tabs (using native Streamlit tabs)
-    tab_keyword, tab_semantic = st.tabs(["🔤 Keyword Search", "🧠 Semantic Search"])
+    tab_keyword, tab_semantic, tab_hybrid = st.tabs(["🔤 Keyword Search", "🧠 Semantic Search", "⚡ Hybrid Search"])
 
     with tab_keyword:
         show_keyword_search_tab()
@@ -28,6 +31,9 @@ def show_search_page():
     with tab_semantic:
         show_semantic_search_tab()
 
+    with tab_hybrid:
+        show_hybrid_search_tab()
+
 
 def show_keyword_search_tab():
     """Keyword-based search form and results."""
@@ -64,9 +70,31 @@ def show_semantic_search_tab():
         key="semantic_input",
         placeholder="e.g. 'How to set up the deployment pipeline'"
     )
-    top_k = st.slider("Number of results", min_value=1, max_value=20, value=5, key="semantic_slider")
+    col1, col2 = st.columns(2)
+    with col1:
+        categories = ["All Categories"] + get_categories()
+        category = st.selectbox("Category", categories, key="semantic_category")
+    with col2:
+        tag = st.text_input("Tag", key="semantic_tag", placeholder="Only items with this tag")
+    result_mode = st.radio(
+        "Results", ["Top matches", "Everything above a similarity"], horizontal=True, key="semantic_result_mode"
+    )
+    if result_mode == "Top matches":
+        top_k = st.slider("Number of results", min_value=1, max_value=20, value=5, key="semantic_slider")
+        min_similarity = None
+    else:
+        top_k = None
+        min_similarity = st.slider(
+            "Minimum similarity (%)", min_value=0, max_value=100, value=int(SEMANTIC_MIN_SIMILARITY * 100),
+            key="semantic_similarity_slider"
+        ) / 100
+
+    # Searching before the model and index are loaded would block on loading them
+    warming_up = get_warmup_status()["status"] == "running"
+    if warming_up:
+        st.info("🔥 Semantic search is warming up (loading the model and index). It will be available in a moment.")
 
-    if st.button("🧠 Semantic Search", key="semantic_search_btn", use_container_width=True):
+    if st.button("🧠 Semantic Search", key="semantic_search_btn", use_container_width=True, disabled=warming_up):
         if not query:
             st.warning("Please enter a search query")
             return
@@ -89,7 +117,10 @@ def show_semantic_search_tab():
             time.sleep(0.4)
 
         try:
-            results = semantic_search_with_details(query, top_k)
+            filtered_category = None if category == "All Categories" else category
+            results = semantic_search_with_details(
+                query, top_k, category=filtered_category, tag=tag, min_similarity=min_similarity
+            )
             status_text.empty()
             progress.empty()
 
@@ -97,7 +128,7 @@ def show_semantic_search_tab():
                 st.success(f"Found {len(results)} semantically similar results")
 
                 for item, score in results:
-                    similarity = max(0, (1 - score) * 100)
+                    similarity = max(0, item['similarity'] * 100)
 
                     with st.expander(f"📄 {item['title']}  —  {similarity:.0f}% match"):
                         # Score bar
@@ -108,12 +139,15 @@ def show_semantic_search_tab():
                         </div>
                         """, unsafe_allow_html=True)
                         st.markdown(render_score_bar(similarity), unsafe_allow_html=True)
+                        if item.get('rerank_score') is not None:
+                            st.markdown(f"**Re-rank score:** {item['rerank_score']:.3f}")
 
-                        # Content preview
-                        content_preview = item['content'][:500]
-                        if len(item['content']) > 500:
+                        # Best-matching passage, falling back to the start of the content
+                        passage = item.get('matched_passage') or item['content']
+                        content_preview = passage[:500]
+                        if len(passage) > 500:
                             content_preview += "..."
-                        st.markdown(f"**Content:** {content_preview}")
+                        st.markdown(f"**Best match:** {content_preview}")
 
                         # Tags
                         if item.get('tags'):
@@ -124,6 +158,7 @@ def show_semantic_search_tab():
                             st.markdown(f"**Tags:** {tags_html}", unsafe_allow_html=True)
 
                         st.markdown(f"**Created:** {item['created_date']}")
+                        display_related_items(item['id'])
 
                         # File attachment
                         if item.get('file_path') and os.path.exists(item['file_path']):
@@ -140,6 +175,90 @@ def show_semantic_search_tab():
             st.info("If this is your first time using semantic search, try adding some knowledge items first.")
 
 
+def show_hybrid_search_tab():
+    """Keyword and semantic search fused into one ranked list."""
+    col1, col2 = st.columns([3, 1])
+    with col1:
+        query = st.text_input(
+            "Search by keywords or meaning",
+            key="hybrid_input",
+            placeholder="e.g. 'deployment pipeline setup'"
+        )
+    with col2:
+        categories = ["All Categories"] + get_categories()
+        category = st.selectbox("Category", categories, key="hybrid_category")
+    top_k = st.slider("Number of results", min_value=1, max_value=20, value=DEFAULT_TOP_K, key="hybrid_slider")
+
+    if get_warmup_status()["status"] == "running":
+        st.info("🔥 Semantic search is still warming up; results will be keyword matches only for now.")
+
+    if st.button("⚡ Hybrid Search", key="hybrid_search_btn", use_container_width=True):
+        if not query:
+            st.warning("Please enter a search query")
+            return
+
+        with st.spinner("Searching..."):
+            filtered_category = None if category == "All Categories" else category
+            results, legs = hybrid_search(query, top_k, filtered_category)
+
+        budgets = {"keyword": HYBRID_KEYWORD_BUDGET_MS, "semantic": HYBRID_SEMANTIC_BUDGET_MS}
+        for leg, stats in legs.items():
+            if stats["timed_out"]:
+                st.warning(f"{leg.capitalize()} search exceeded its {budgets[leg]} ms budget; showing partial results")
+            elif stats["error"]:
+                st.warning(f"{leg.capitalize()} search failed: {stats['error']}")
+
+        if not results:
+            st.markdown(
+                render_empty_state("⚡", "No results found", "Try different keywords or rephrasing your query"),
+                unsafe_allow_html=True
+            )
+            return
+
+        st.success(f"Found {len(results)} results")
+        for item, score in results:
+            scores = item["hybrid_scores"]
+            sources = []
+            if "keyword_rank" in scores:
+                sources.append(f"Keyword #{scores['keyword_rank']}")
+            if "semantic_rank" in scores:
+                similarity = max(0, scores["semantic_similarity"] * 100)
+                sources.append(f"Semantic #{scores['semantic_rank']} ({similarity:.0f}% match)")
+
+            with st.expander(f"📄 {item['title']}  —  {' · '.join(sources)}"):
+                st.markdown(f"""
+                <div style="display: flex; align-items: center; gap: 1rem; margin-bottom: 0.75rem;">
+                    {render_badge(item['category'])}
+                    <span style="color: #8899AA; font-size: 0.85rem;">Fused score: {score:.4f}</span>
+                </div>
+                """, unsafe_allow_html=True)
+
+                passage = item.get('matched_passage') or item['content']
+                content_preview = passage[:500]
+                if len(passage) > 500:
+                    content_preview += "..."
+                st.markdown(content_preview)
+
+                st.markdown(f"**Created:** {item['created_date']}")
+                display_related_items(item['id'])
+
+                if item.get('file_path') and os.path.exists(item['file_path']):
+                    display_attachment(item['file_path'])
+
+
+def display_related_items(item_id):
+    """Display an item's precomputed related knowledge as one line of titles."""
+    related = get_related_items(item_id)
+    if not related:
+        return
+
+    links = [
+        f"{related_item['title']} ({max(0, distance_to_similarity(distance) * 100):.0f}%)"
+        for related_item, distance in related
+    ]
+    st.markdown(f"**Related knowledge:** {' · '.join(links)}")
+
+
 def display_search_results(results):
     """Display keyword search results as styled cards."""
     for item in results:
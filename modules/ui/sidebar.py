@@ -47,6 +47,15 @@ def show_sidebar():
 
         st.markdown('<hr class="section-divider">', unsafe_allow_html=True)
 
+        # Search warm-up state
+        from modules.vectorstore import get_warmup_status
+
+        warmup = get_warmup_status()
+        if warmup["status"] == "running":
+            st.caption("🔥 Warming up semantic search...")
+        elif warmup["status"] == "failed":
+            st.caption(f"⚠️ Semantic search warm-up failed: {warmup['error']}")
+
         # Version
         st.markdown("""
         <div style="text-align: center; padding: 0.5rem 0;">
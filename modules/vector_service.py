@@ -0,0 +1,236 @@
+import os
+import sys
+import json
+import time
+import base64
+import socket
+import argparse
+import socketserver
+import numpy as np
+from config import (
+    VECTOR_SERVICE_ADDRESS, VECTOR_SERVICE_TIMEOUT_SECONDS, VECTOR_SERVICE_RETRY_SECONDS, VECTOR_SERVICE_ENCODE_BATCH_SIZE
+)
+
+# When the last connection attempt failed, so callers stay in-process until the retry delay passes
+service_state = {"down_until": 0.0}
+
+class VectorServiceUnavailable(Exception):
+    """The vector service could not be reached; the caller should do the work in-process"""
+
+class VectorServiceError(Exception):
+    """The vector service was reached but the request failed there"""
+
+def encode_array(vectors):
+    """Pack a float32 matrix for a JSON message (same encoding as the delta log)"""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    return {"shape": list(vectors.shape), "data": base64.b64encode(vectors.tobytes()).decode("ascii")}
+
+def decode_array(message):
+    """Unpack a matrix packed by encode_array()"""
+    return np.frombuffer(base64.b64decode(message["data"]), dtype=np.float32).reshape(message["shape"])
+
+def parse_address(address):
+    """Split "unix:/path" or "host:port" into (socket family, address)"""
+    if address.startswith("unix:"):
+        return socket.AF_UNIX, address[len("unix:"):]
+    host, _, port = address.rpartition(":")
+    return socket.AF_INET, (host or "127.0.0.1", int(port))
+
+def call_vector_service(op, address=VECTOR_SERVICE_ADDRESS, timeout=VECTOR_SERVICE_TIMEOUT_SECONDS, **params):
+    """Send one request to the vector service and return its result
+
+    Raises VectorServiceUnavailable when no service is configured or it cannot
+    be reached (every operation is safe to redo in-process), and
+    VectorServiceError when the service ran the request and it failed or did
+    not answer within the timeout (it is up, just busy, so it is not marked down).
+    """
+    if not address or time.time() < service_state["down_until"]:
+        raise VectorServiceUnavailable("vector service is not available")
+
+    family, target = parse_address(address)
+    with socket.socket(family, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        try:
+            sock.connect(target)
+        except OSError as e:
+            service_state["down_until"] = time.time() + VECTOR_SERVICE_RETRY_SECONDS
+            raise VectorServiceUnavailable(f"vector service at {address} is unreachable: {e}")
+        try:
+            sock.sendall((json.dumps(dict(params, op=op)) + "\n").encode("utf-8"))
+            with sock.makefile("rb") as f:
+                line = f.readline()
+        except socket.timeout:
+            raise VectorServiceError(f"vector service at {address} did not answer {op} within {timeout} seconds")
+        except OSError as e:
+            service_state["down_until"] = time.time() + VECTOR_SERVICE_RETRY_SECONDS
+            raise VectorServiceUnavailable(f"vector service at {address} dropped the connection: {e}")
+    if not line:
+        raise VectorServiceUnavailable(f"vector service at {address} closed the connection")
+
+    response = json.loads(line)
+    if not response["ok"]:
+        raise VectorServiceError(response["error"])
+    return response["result"]
+
+class RemoteEmbeddingEngine:
+    """Embedding engine that encodes in the vector service, with a local engine as fallback
+
+    fallback is a callable returning the local engine; it is only called (and
+    the model only loaded) when the service is unavailable.
+    """
+
+    def __init__(self, fallback):
+        self.fallback = fallback
+        self.info = None
+
+    def get_info(self):
+        if self.info is None:
+            self.info = call_vector_service("info")
+        return self.info
+
+    @property
+    def cache_name(self):
+        try:
+            return self.get_info()["cache_name"]
+        except VectorServiceUnavailable:
+            return self.fallback().cache_name
+
+    @property
+    def dimension(self):
+        try:
+            return self.get_info()["dimension"]
+        except VectorServiceUnavailable:
+            return self.fallback().dimension
+
+    def encode(self, texts, progress_callback=None):
+        """Encode in requests of VECTOR_SERVICE_ENCODE_BATCH_SIZE texts, reporting progress after each"""
+        texts = list(texts)
+        batches = []
+        # An empty list still makes one request, so the result has the service's shape
+        for start in range(0, max(len(texts), 1), VECTOR_SERVICE_ENCODE_BATCH_SIZE):
+            try:
+                batches.append(decode_array(call_vector_service("encode", texts=texts[start:start + VECTOR_SERVICE_ENCODE_BATCH_SIZE])))
+            except VectorServiceUnavailable:
+                # The service went away part way through; encode the rest here
+                rest = self.fallback().encode(
+                    texts[start:],
+                    progress_callback=(lambda done, total: progress_callback(start + done, len(texts))) if progress_callback else None
+                )
+                batches.append(rest)
+                break
+            if progress_callback:
+                progress_callback(start + len(batches[-1]), len(texts))
+        return np.concatenate(batches)
+
+    def embed_documents(self, texts):
+        return self.encode(texts).tolist()
+
+    def embed_query(self, text):
+        try:
+            return decode_array(call_vector_service("embed_query", text=text)).tolist()
+        except VectorServiceUnavailable:
+            return self.fallback().embed_query(text)
+
+    def embed_queries(self, texts):
+        texts = list(texts)
+        try:
+            return decode_array(call_vector_service("embed_queries", texts=texts))
+        except VectorServiceUnavailable:
+            return self.fallback().embed_queries(texts)
+
+def handle_request(request):
+    """Run one service request against this process's model and index"""
+    from modules.vectorstore import (
+        get_embeddings, get_vectorstore, semantic_search, embed_query_cached, embed_queries_cached, normalize_query,
+        find_similar_passages
+    )
+    from modules.index_queue import index_worker_wakeup
+
+    op = request.pop("op")
+    if op == "info":
+        embeddings = get_embeddings()
+        return {
+            "pid": os.getpid(),
+            "model_name": embeddings.model_name,
+            "cache_name": embeddings.cache_name,
+            "dimension": embeddings.dimension,
+            "vectors": len(get_vectorstore())
+        }
+    if op == "encode":
+        return encode_array(get_embeddings().encode(request["texts"]))
+    if op == "embed_query":
+        return encode_array(embed_query_cached(normalize_query(request["text"])))
+    if op == "embed_queries":
+        return encode_array(embed_queries_cached([normalize_query(text) for text in request["texts"]]))
+    if op == "search":
+        results = semantic_search(request["query"], request["k"], request.get("item_ids"), request.get("min_similarity"))
+        return [list(result) for result in results]
+    if op == "similar_passages":
+        return [[list(hit) for hit in hits] for hits in find_similar_passages(request["passages"], request["k"])]
+    if op == "process_jobs":
+        index_worker_wakeup.set()
+        return None
+    raise ValueError(f"unknown operation: {op}")
+
+class VectorServiceHandler(socketserver.StreamRequestHandler):
+    """One JSON request per line, answered with {"ok": true, "result": ...} or {"ok": false, "error": ...}"""
+
+    def handle(self):
+        for line in self.rfile:
+            try:
+                response = {"ok": True, "result": handle_request(json.loads(line))}
+            except Exception as e:
+                response = {"ok": False, "error": str(e)}
+            self.wfile.write((json.dumps(response) + "\n").encode("utf-8"))
+            self.wfile.flush()
+
+class ThreadingUnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+class ThreadingTCPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+def make_server(address):
+    """Create a threaded server listening on "unix:/path" or "host:port\""""
+    family, target = parse_address(address)
+    if family == socket.AF_UNIX:
+        # A socket file left by a previous run would make bind() fail
+        if os.path.exists(target):
+            os.remove(target)
+        return ThreadingUnixServer(target, VectorServiceHandler)
+    return ThreadingTCPServer(target, VectorServiceHandler)
+
+def serve(address=VECTOR_SERVICE_ADDRESS):
+    """Load the model and index once, run the index job worker and serve requests until stopped"""
+    from modules.database import init_database
+    from modules.vectorstore import pinned_resources, load_embeddings, load_vectorstore
+    from modules.index_queue import start_index_worker
+
+    init_database()
+
+    # st.cache_resource only caches inside a Streamlit app, so keep this process's instances here
+    pinned_resources["embeddings"] = load_embeddings()
+    pinned_resources["vectorstore"] = load_vectorstore()
+    pinned_resources["embeddings"].embed_query("warm up")
+
+    # Index jobs from every app process are handled here, next to the index
+    start_index_worker()
+
+    server = make_server(address)
+    print(f"Vector service listening on {address} ({len(pinned_resources['vectorstore'])} vectors)", flush=True)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve embeddings and vector search to the app processes")
+    parser.add_argument("--address", default=VECTOR_SERVICE_ADDRESS,
+                        help='"unix:/path/to/socket" or "host:port" (default: VECTOR_SERVICE_ADDRESS)')
+    args = parser.parse_args()
+
+    if not args.address:
+        print("Set VECTOR_SERVICE_ADDRESS in config.py or pass --address")
+        sys.exit(2)
+    serve(args.address)
@@ -1,153 +1,1487 @@
 import os
+import json
+import math
+import base64
+import threading
+import time
+import contextlib
+import collections
+import faiss
+import numpy as np
 import streamlit as st
-from langchain_community.vectorstores import FAISS
-from langchain_community.embeddings import HuggingFaceEmbeddings
-from langchain.schema import Document
-from config import VECTORSTORE_PATH, EMBEDDING_MODEL
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+from modules.database import get_db_connection
+from modules.embeddings import EmbeddingEngine, OnnxEmbeddingEngine, text_hash, prune_cached_embeddings
+from modules.vector_service import call_vector_service, VectorServiceUnavailable, VectorServiceError, RemoteEmbeddingEngine
+from config import (
+    VECTORSTORE_PATH, CHUNK_SIZE, CHUNK_OVERLAP, DELTA_LOG_COMPACT_BYTES,
+    INDEX_TYPE, IVF_MIN_VECTORS, HNSW_MIN_VECTORS, INDEX_RETRAIN_GROWTH,
+    IVF_NPROBE, HNSW_M, HNSW_EF_CONSTRUCTION, HNSW_EF_SEARCH, HNSW_MAX_DELETED_RATIO,
+    INDEX_QUANTIZATION, PQ_M, PQ_MIN_TRAINING_VECTORS, RERANK_FACTOR, INDEX_MMAP, INDEX_METRIC,
+    INDEX_REDUCTION, INDEX_REDUCED_DIM, REDUCTION_MIN_TRAINING_VECTORS,
+    QUERY_CACHE_SIZE, QUERY_BATCH_WINDOW_MS, QUERY_BATCH_MAX_SIZE, EMBEDDING_BACKEND, WARMUP_READY_FILE, CROSS_ENCODER_MODEL, CROSS_ENCODER_BATCH_SIZE, CROSS_ENCODER_BUDGET_MS,
+    VECTOR_SERVICE_ADDRESS
+)
+
+try:
+    import fcntl
+except ImportError:
+    # Windows: index_lock() only serialises threads of one process
+    fcntl = None
+
+ID_MAP_PATH = os.path.join(VECTORSTORE_PATH, "index_ids.npz")
+DELTA_LOG_PATH = os.path.join(VECTORSTORE_PATH, "delta.log")
+INDEX_LOCK_PATH = os.path.join(VECTORSTORE_PATH, "index.lock")
+
+# Serialises index mutation, searches and delta log appends across sessions
+vectorstore_lock = threading.RLock()
+
+# Cross-process lock on the saved index files, see index_lock(). flock() locks belong to an
+# open file, so the process holds one handle and only the outermost index_lock() takes it
+index_file_lock_state = {"file": None, "depth": 0}
+
+# Set by compaction so the index worker prunes the embedding cache, see prune_embedding_cache_if_due()
+embedding_cache_state = {"prune_due": False}
+
+# Model and index held for the life of a process outside the Streamlit runtime, where
+# st.cache_resource does not cache (set by the vector service, see modules.vector_service)
+pinned_resources = {}
+
+# Background warm-up progress: idle -> running -> ready / failed, see start_warmup()
+warmup_state = {"status": "idle", "error": None, "seconds": None}
+warmup_lock = threading.Lock()
+
+# Recent query vectors by normalized query, least recently used first, see embed_queries_cached()
+query_cache = collections.OrderedDict()
+query_cache_stats = {"hits": 0, "misses": 0}
+query_cache_lock = threading.Lock()
+
+# Semantic searches waiting to be run together, see batched_search()
+query_batch_state = {"pending": [], "busy": False, "last_size": 0, "batches": 0, "queries": 0}
+query_batch_condition = threading.Condition()
+
+# Cumulative cross-encoder timings, see get_cross_encoder_stats()
+cross_encoder_stats = {"queries": 0, "candidates": 0, "scored": 0, "ms": 0.0, "over_budget": 0, "reordered": 0}
+cross_encoder_stats_lock = threading.Lock()
+
+class KnowledgeVectorStore:
+    """FAISS index keyed by stable int64 vector ids, plus a map from each vector id to
+    its (knowledge item id, chunk number)
+
+    Passage text is not kept here; it is re-derived by chunking the item's
+    content from the database when it is needed.
+
+    Vector ids are never reused, so an index that cannot remove vectors (HNSW)
+    can hide deleted ones behind a tombstone selector until the next rebuild.
+
+    A base index loaded with mmap is read-only: new vectors go to a small
+    in-memory flat delta index and deletions become tombstones, both of which
+    are merged into a writable copy of the base at compaction.
+
+    saved_signature and log_offset record which saved files and how much of
+    the delta log this copy reflects, so sync_vectorstore() can pick up what
+    other processes have written since.
+    """
+
+    def __init__(self, index=None, chunks=None, next_id=0, deleted_ids=None, trained_size=0, read_only=False):
+        self.index = index
+        self.chunks = chunks or {}
+        self.next_id = next_id
+        self.deleted_ids = deleted_ids or set()
+        self.trained_size = trained_size
+        self.read_only = read_only
+        self.delta_index = None
+        self.delta_ids = set()
+        self.saved_signature = None
+        self.log_offset = 0
+        self.item_vector_ids = {}
+        for vector_id, (doc_id, _) in self.chunks.items():
+            self.item_vector_ids.setdefault(doc_id, []).append(vector_id)
+        if self.index is not None:
+            configure_search_parameters(self.index)
+
+    def __len__(self):
+        return len(self.chunks)
+
+    @property
+    def metric(self):
+        """Metric of the loaded index ("l2" or "cosine"), or the configured one before an index exists"""
+        return get_index_metric(self.index) if self.index is not None else INDEX_METRIC
+
+    def add(self, chunk_refs, vectors, vector_ids=None):
+        """Add (knowledge item id, chunk number) pairs with precomputed vectors, returning their vector ids"""
+        vectors = prepare_vectors(vectors, self.metric)
+        if vector_ids is None:
+            vector_ids = list(range(self.next_id, self.next_id + len(chunk_refs)))
+        if not vector_ids:
+            return []
+
+        if self.index is None:
+            self.index = create_index(vectors.shape[1], len(vector_ids), vectors)
+            self.trained_size = len(vector_ids)
+            self.read_only = False
+
+        if self.read_only:
+            # A memory-mapped base must never be written to
+            if self.delta_index is None:
+                self.delta_index = faiss.index_factory(vectors.shape[1], "IDMap,Flat", self.index.metric_type)
+            self.delta_index.add_with_ids(vectors, np.array(vector_ids, dtype=np.int64))
+            self.delta_ids.update(vector_ids)
+        else:
+            self.index.add_with_ids(vectors, np.array(vector_ids, dtype=np.int64))
+
+        for vector_id, (doc_id, chunk) in zip(vector_ids, chunk_refs):
+            self.chunks[vector_id] = (doc_id, chunk)
+            self.item_vector_ids.setdefault(doc_id, []).append(vector_id)
+        self.next_id = max(self.next_id, max(vector_ids) + 1)
+        return vector_ids
+
+    def remove(self, vector_ids):
+        """Remove vectors by id (tombstoned when the index cannot delete in place)"""
+        vector_ids = [vector_id for vector_id in vector_ids if vector_id in self.chunks]
+        if not vector_ids:
+            return
+
+        delta_ids = [vector_id for vector_id in vector_ids if vector_id in self.delta_ids]
+        base_ids = [vector_id for vector_id in vector_ids if vector_id not in self.delta_ids]
+        if delta_ids:
+            self.delta_index.remove_ids(faiss.IDSelectorBatch(np.array(delta_ids, dtype=np.int64)))
+            self.delta_ids.difference_update(delta_ids)
+        if base_ids:
+            if self.read_only or not supports_remove(self.index):
+                self.deleted_ids.update(base_ids)
+            else:
+                self.index.remove_ids(faiss.IDSelectorBatch(np.array(base_ids, dtype=np.int64)))
+
+        for vector_id in vector_ids:
+            doc_id, _ = self.chunks.pop(vector_id)
+            item_ids = self.item_vector_ids.get(doc_id, [])
+            if vector_id in item_ids:
+                item_ids.remove(vector_id)
+            if not item_ids:
+                self.item_vector_ids.pop(doc_id, None)
+
+    def count_index_rows(self):
+        """Number of live rows in the FAISS indexes, which should equal len(self)"""
+        rows = self.index.ntotal if self.index is not None else 0
+        if self.delta_index is not None:
+            rows += self.delta_index.ntotal
+        return rows - len(self.deleted_ids)
+
+    def get_item_vector_ids(self, doc_id):
+        """Get the vector ids indexed for a knowledge item"""
+        return list(self.item_vector_ids.get(doc_id, []))
+
+    def search(self, vector, k, item_ids=None):
+        """Return (knowledge item id, chunk number, distance) for the k vectors closest to a query vector
+
+        With item_ids, only chunks of those knowledge items are considered; the
+        restriction is applied inside the index scan rather than by discarding hits.
+        """
+        return self.search_batch([vector], k, item_ids)[0]
+
+    def search_batch(self, vectors, k, item_ids=None):
+        """search() for several query vectors at once, with one FAISS search per index
+
+        The indexes are searched under vectorstore_lock; exact re-ranking, which
+        may have to run the embedding model, happens after it is released.
+        """
+        with vectorstore_lock:
+            rerank, queries, all_results = self.search_candidates(vectors, k, item_ids)
+        if rerank:
+            all_results = [self.rerank_exact(query, results) if results else results for query, results in zip(queries, all_results)]
+        return [results[:k] for results in all_results]
+
+    def search_candidates(self, vectors, k, item_ids=None):
+        """Index side of search_batch(): (whether to re-rank, prepared queries, candidates per query)"""
+        if self.index is None or not self.chunks:
+            return False, None, [[] for _ in vectors]
+
+        allowed_ids = None
+        candidate_count = len(self.chunks)
+        if item_ids is not None:
+            allowed_ids = [vector_id for doc_id in item_ids for vector_id in self.item_vector_ids.get(doc_id, [])]
+            if not allowed_ids:
+                return False, None, [[] for _ in vectors]
+            candidate_count = len(allowed_ids)
+
+        # Compressed codes and reduced vectors only approximate distances, so over-fetch and re-rank exactly
+        rerank = has_approximate_distances(self.index) and RERANK_FACTOR > 0
+        fetch_k = k * RERANK_FACTOR if rerank else k
+
+        queries = prepare_vectors(np.asarray(vectors, dtype=np.float32).reshape(len(vectors), -1), self.metric)
+        fetch_k = min(fetch_k, candidate_count)
+        all_hits = search_index(self.index, queries, fetch_k, self.deleted_ids, allowed_ids)
+
+        # Vectors written since the base was mapped live in the delta index
+        if self.delta_ids:
+            delta_hits = search_index(self.delta_index, queries, min(fetch_k, len(self.delta_ids)), (), allowed_ids)
+            all_hits = [
+                sorted(hits + more_hits, key=lambda hit: hit[0])[:fetch_k]
+                for hits, more_hits in zip(all_hits, delta_hits)
+            ]
+
+        return rerank, queries, [self.resolve_hits(hits) for hits in all_hits]
+
+    def range_search_batch(self, vectors, min_similarity, item_ids=None):
+        """Return every (knowledge item id, chunk number, distance) within min_similarity of each query, closest first
+
+        Uses FAISS range search, so the result size follows the data instead of
+        a fixed k. Similarity is cosine similarity (see distance_to_similarity()).
+        An index with approximate distances can put a true hit outside the radius,
+        so there the search is k-NN with exact re-ranking instead, growing k
+        until the cut-off falls inside the result (see range_search_reranked()).
+        """
+        with vectorstore_lock:
+            if self.index is None or not self.chunks:
+                return [[] for _ in vectors]
+            if not (has_approximate_distances(self.index) and RERANK_FACTOR > 0):
+                return self.range_search_exact(vectors, min_similarity, item_ids)
+        return self.range_search_reranked(vectors, min_similarity, item_ids)
+
+    def range_search_exact(self, vectors, min_similarity, item_ids=None):
+        """range_search_batch() for indexes with exact distances (caller holds vectorstore_lock)"""
+        allowed_ids = None
+        if item_ids is not None:
+            allowed_ids = [vector_id for doc_id in item_ids for vector_id in self.item_vector_ids.get(doc_id, [])]
+            if not allowed_ids:
+                return [[] for _ in vectors]
+
+        queries = prepare_vectors(np.asarray(vectors, dtype=np.float32).reshape(len(vectors), -1), self.metric)
+        max_distance = similarity_to_distance(min_similarity, self.metric)
+
+        params = make_search_params(self.index, self.deleted_ids, allowed_ids)
+        all_hits = range_search_index(self.index, queries, max_distance, params)
+        if self.delta_ids:
+            params = make_search_params(self.delta_index, (), allowed_ids)
+            delta_hits = range_search_index(self.delta_index, queries, max_distance, params)
+            all_hits = [sorted(hits + more_hits, key=lambda hit: hit[0]) for hits, more_hits in zip(all_hits, delta_hits)]
+        if allowed_ids is not None and not accepts_search_params(self.index):
+            # The allow list could not be passed to the index, so apply it to the hits
+            allowed = set(allowed_ids)
+            all_hits = [[hit for hit in hits if hit[1] in allowed] for hits in all_hits]
+
+        return [self.resolve_hits(hits) for hits in all_hits]
+
+    def range_search_reranked(self, vectors, min_similarity, item_ids=None):
+        """range_search_batch() for indexes with approximate distances
+
+        Each round is a search_batch() of k, which re-ranks RERANK_FACTOR x k
+        candidates exactly; a query whose k exact results are all in range is
+        searched again with 4 x k. Hits are found as reliably as by a top-k
+        search with k = the number of hits.
+        """
+        max_distance = similarity_to_distance(min_similarity, self.metric)
+        all_results = [None] * len(vectors)
+        pending = list(range(len(vectors)))
+        k = 64
+        while pending:
+            still_pending = []
+            for i, results in zip(pending, self.search_batch([vectors[i] for i in pending], k, item_ids)):
+                in_range = [result for result in results if result[2] <= max_distance]
+                if len(in_range) == k and k < len(self.chunks):
+                    still_pending.append(i)
+                else:
+                    all_results[i] = in_range
+            pending = still_pending
+            k *= 4
+        return all_results
+
+    def resolve_hits(self, hits):
+        """Turn (distance, vector id) hits into (knowledge item id, chunk number, distance), dropping unknown ids"""
+        results = []
+        for distance, vector_id in hits:
+            chunk_ref = self.chunks.get(int(vector_id))
+            if chunk_ref is not None:
+                results.append((chunk_ref[0], chunk_ref[1], float(distance)))
+        return results
+
+    def rerank_exact(self, query, results):
+        """Re-score candidates with full-precision vectors (read from the embedding cache)"""
+        passages = load_passages([(doc_id, chunk) for doc_id, chunk, _ in results])
+        exact_vectors = prepare_vectors(get_embeddings().encode(passages), self.metric)
+        if self.metric == "cosine":
+            exact_distances = 1 - exact_vectors @ query
+        else:
+            exact_distances = ((exact_vectors - query) ** 2).sum(axis=1)
+        order = np.argsort(exact_distances, kind="stable")
+        return [(results[i][0], results[i][1], float(exact_distances[i])) for i in order]
+
+    def needs_rebuild(self):
+        """Whether the corpus has outgrown the index type or accumulated too many tombstones"""
+        if self.index is None:
+            return False
+
+        # Distances from an index built for the other metric mean something else
+        if get_index_metric(self.index) != INDEX_METRIC:
+            return True
+
+        # INDEX_REDUCTION was changed, or a corpus has grown large enough to train PCA on
+        current_reduction = get_reduction(self.index)
+        configured_reduction = (INDEX_REDUCTION, INDEX_REDUCED_DIM) if INDEX_REDUCTION else None
+        if current_reduction != configured_reduction:
+            if current_reduction is not None or choose_reduction(len(self.chunks), self.index.d) is not None:
+                return True
+
+        # Switch up as soon as a threshold is crossed, but only switch down once the
+        # corpus is well below it, so edits around a threshold do not flip-flop
+        current_rank = INDEX_TYPE_RANKS[get_index_type(self.index)]
+        if INDEX_TYPE_RANKS[choose_index_type(len(self.chunks))] > current_rank:
+            return True
+        if INDEX_TYPE_RANKS[choose_index_type(len(self.chunks) * 2)] < current_rank:
+            return True
+        if choose_quantization(len(self.chunks)) != get_quantization(self.index):
+            return True
+
+        # IVF centroids and quantizer codebooks go stale as the corpus grows
+        needs_training = (
+            get_index_type(self.index) == "ivf" or get_quantization(self.index) is not None
+            or current_reduction is not None and current_reduction[0] == "pca"
+        )
+        if needs_training and len(self.chunks) > self.trained_size * INDEX_RETRAIN_GROWTH:
+            return True
+
+        # Other index types drop their tombstones when the delta is merged
+        if supports_remove(self.index):
+            return False
+        return len(self.deleted_ids) > HNSW_MAX_DELETED_RATIO * max(len(self.chunks), 1)
+
+    def rebuild_index(self):
+        """Re-create the FAISS index for the current corpus size from the stored passages"""
+        vector_ids = sorted(self.chunks)
+        texts = load_passages([self.chunks[vector_id] for vector_id in vector_ids])
+
+        # ส่วนใหญ่ได้จาก embedding cache จึงไม่ต้องรันโมเดลใหม่
+        vectors = prepare_vectors(get_embeddings().encode(texts), INDEX_METRIC) if texts else None
+
+        self.index = None
+        self.read_only = False
+        self.delta_index = None
+        self.delta_ids = set()
+        self.deleted_ids = set()
+        if texts:
+            self.index = create_index(vectors.shape[1], len(vector_ids), vectors)
+            self.index.add_with_ids(vectors, np.array(vector_ids, dtype=np.int64))
+        self.trained_size = len(vector_ids)
+
+    def merge_delta(self, folder_path):
+        """Fold the delta index and removable tombstones into a writable base index"""
+        if self.read_only:
+            # The mapped base cannot be modified, so read a private copy of it
+            self.index = faiss.read_index(os.path.join(folder_path, "index.faiss"))
+            configure_search_parameters(self.index)
+            self.read_only = False
+
+        if self.delta_ids:
+            vector_ids = faiss.vector_to_array(self.delta_index.id_map)
+            vectors = self.delta_index.index.reconstruct_n(0, self.delta_index.ntotal)
+            self.index.add_with_ids(vectors, vector_ids)
+        self.delta_index = None
+        self.delta_ids = set()
+
+        if self.deleted_ids and self.index is not None and supports_remove(self.index):
+            self.index.remove_ids(faiss.IDSelectorBatch(np.array(sorted(self.deleted_ids), dtype=np.int64)))
+            self.deleted_ids = set()
+
+    def map_index(self, folder_path):
+        """Swap the in-memory base index for a read-only memory map of the saved file"""
+        index_path = os.path.join(folder_path, "index.faiss")
+        if self.index is not None and not self.delta_ids and os.path.exists(index_path):
+            self.index = read_index_mapped(index_path, get_index_type(self.index))
+            configure_search_parameters(self.index)
+            self.read_only = True
+
+    def save(self, folder_path):
+        """Write the FAISS index and the vector id map to disk (call merge_delta() first)"""
+        os.makedirs(folder_path, exist_ok=True)
+        index_path = os.path.join(folder_path, "index.faiss")
+        id_map_path = os.path.join(folder_path, "index_ids.npz")
+
+        # Write to temporary files and rename so readers never see a half-written file
+        if self.index is not None:
+            faiss.write_index(self.index, index_path + ".tmp")
+            os.replace(index_path + ".tmp", index_path)
+        elif os.path.exists(index_path):
+            os.remove(index_path)
+
+        vector_ids = sorted(self.chunks)
+        with open(id_map_path + ".tmp", "wb") as f:
+            np.savez(
+                f,
+                vector_ids=np.array(vector_ids, dtype=np.int64),
+                item_ids=np.array([self.chunks[vector_id][0] for vector_id in vector_ids], dtype=np.int64),
+                chunks=np.array([self.chunks[vector_id][1] for vector_id in vector_ids], dtype=np.int32),
+                deleted_ids=np.array(sorted(self.deleted_ids), dtype=np.int64),
+                next_id=np.int64(self.next_id),
+                trained_size=np.int64(self.trained_size),
+                index_type=np.str_(get_index_type(self.index) if self.index is not None else "")
+            )
+        os.replace(id_map_path + ".tmp", id_map_path)
+        self.saved_signature = get_saved_signature(folder_path)
+
+        # ไฟล์ docstore แบบเก่าเก็บเนื้อหาซ้ำกับฐานข้อมูล ไม่ต้องใช้แล้ว
+        legacy_docstore_path = os.path.join(folder_path, "index.pkl")
+        if os.path.exists(legacy_docstore_path):
+            os.remove(legacy_docstore_path)
+
+    @classmethod
+    def load(cls, folder_path, mmap=False):
+        """Read a vector store written by save(), optionally memory-mapping the index read-only"""
+        saved_signature = get_saved_signature(folder_path)
+        with np.load(os.path.join(folder_path, "index_ids.npz")) as state:
+            chunks = {
+                int(vector_id): (int(doc_id), int(chunk))
+                for vector_id, doc_id, chunk in zip(state["vector_ids"], state["item_ids"], state["chunks"])
+            }
+            deleted_ids = set(int(vector_id) for vector_id in state["deleted_ids"])
+            next_id = int(state["next_id"])
+            trained_size = int(state["trained_size"])
+            index_type = str(state["index_type"]) or None
+
+        index_path = os.path.join(folder_path, "index.faiss")
+        index = None
+        read_only = False
+        if os.path.exists(index_path):
+            if mmap:
+                index = read_index_mapped(index_path, index_type)
+                read_only = True
+            else:
+                index = faiss.read_index(index_path)
+        vectorstore = cls(index, chunks, next_id, deleted_ids, trained_size, read_only=read_only)
+        vectorstore.saved_signature = saved_signature
+        return vectorstore
+
+    def reload(self, folder_path, mmap=False):
+        """Replace this store's contents with the saved files, in place so cached references stay valid"""
+        self.__dict__.update(type(self).load(folder_path, mmap=mmap).__dict__)
+
+def get_saved_signature(folder_path):
+    """(inode, mtime, size) of the saved id map, which changes on every save(); None if nothing is saved"""
+    try:
+        stat = os.stat(os.path.join(folder_path, "index_ids.npz"))
+    except FileNotFoundError:
+        return None
+    return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+@contextlib.contextmanager
+def index_lock(exclusive=True):
+    """Hold vectorstore_lock and the cross-process lock on the saved index files
+
+    Writers (delta log appends, compaction) take it exclusive, readers of the
+    files shared. Nested calls reuse the outermost lock, so a shared lock must
+    never wrap an exclusive one.
+    """
+    with vectorstore_lock:
+        state = index_file_lock_state
+        if state["depth"] == 0 and fcntl is not None:
+            os.makedirs(VECTORSTORE_PATH, exist_ok=True)
+            state["file"] = open(INDEX_LOCK_PATH, "a")
+            fcntl.flock(state["file"], fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        state["depth"] += 1
+        try:
+            yield
+        finally:
+            state["depth"] -= 1
+            if state["depth"] == 0 and state["file"] is not None:
+                fcntl.flock(state["file"], fcntl.LOCK_UN)
+                state["file"].close()
+                state["file"] = None
+
+def sync_vectorstore(vectorstore):
+    """Bring a loaded store up to date with changes other processes have written
+
+    Costs two stat() calls when nothing changed. If another process compacted
+    (the saved id map changed) the store is reloaded; if it appended to the
+    delta log only the new records are replayed. Stores that were never saved
+    or loaded are left alone.
+    """
+    if vectorstore.saved_signature is None:
+        return
+    if (get_saved_signature(VECTORSTORE_PATH) in (None, vectorstore.saved_signature)
+            and get_file_size(DELTA_LOG_PATH) == vectorstore.log_offset):
+        return
+
+    with index_lock(exclusive=False):
+        saved_signature = get_saved_signature(VECTORSTORE_PATH)
+        if saved_signature is not None and saved_signature != vectorstore.saved_signature:
+            vectorstore.reload(VECTORSTORE_PATH, mmap=INDEX_MMAP)
+        replay_delta_log(vectorstore)
+
+def get_file_size(path):
+    """Size of a file in bytes, 0 if it does not exist"""
+    try:
+        return os.path.getsize(path)
+    except FileNotFoundError:
+        return 0
+
+def read_index_mapped(index_path, index_type):
+    """Memory-map a saved index read-only so its pages are loaded on demand and shared between processes
+
+    IO_FLAG_MMAP maps IVF inverted lists; flat and HNSW vector codes need
+    IO_FLAG_MMAP_IFC, which older faiss builds lack. The flags cannot be
+    combined, so they are picked by index type. Anything faiss cannot map is
+    read normally.
+    """
+    if index_type == "ivf":
+        flag = faiss.IO_FLAG_MMAP
+    else:
+        flag = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP)
+    try:
+        return faiss.read_index(index_path, flag | faiss.IO_FLAG_READ_ONLY)
+    except RuntimeError:
+        return faiss.read_index(index_path)
+
+INDEX_TYPE_RANKS = {"flat": 0, "ivf": 1, "hnsw": 2}
+
+def choose_index_type(vector_count):
+    """Pick flat, IVF or HNSW for a corpus size (INDEX_TYPE overrides "auto")"""
+    if INDEX_TYPE != "auto":
+        return INDEX_TYPE
+    if vector_count >= HNSW_MIN_VECTORS:
+        return "hnsw"
+    if vector_count >= IVF_MIN_VECTORS:
+        return "ivf"
+    return "flat"
+
+def choose_quantization(vector_count):
+    """Pick the vector encoding: None (float32), "sq8" or "pq"
+
+    PQ codebooks need a reasonably large training set, so small corpora use
+    SQ8 until they reach PQ_MIN_TRAINING_VECTORS.
+    """
+    if INDEX_QUANTIZATION == "pq" and vector_count < PQ_MIN_TRAINING_VECTORS:
+        return "sq8"
+    return INDEX_QUANTIZATION
+
+def choose_reduction(vector_count, dimension):
+    """Pick the dimensionality reduction as (kind, reduced dimension), or None
+
+    PCA needs at least as many training vectors as input dimensions, so small
+    corpora are indexed at full dimension until they reach REDUCTION_MIN_TRAINING_VECTORS.
+    """
+    if not INDEX_REDUCTION or INDEX_REDUCED_DIM >= dimension:
+        return None
+    if INDEX_REDUCTION == "pca" and vector_count < max(REDUCTION_MIN_TRAINING_VECTORS, dimension):
+        return None
+    return INDEX_REDUCTION, INDEX_REDUCED_DIM
+
+def get_reduction_transform(reduction, metric):
+    """index_factory prefix applying a reduction; cosine indexes re-normalize the reduced vectors"""
+    if reduction is None:
+        return ""
+    kind, dimension = reduction
+    transform = f"PCA{dimension}," if kind == "pca" else f"RR{dimension},"
+    return transform + "L2norm," if metric == faiss.METRIC_INNER_PRODUCT else transform
+
+def create_index(dimension, vector_count, training_vectors=None, reduction="auto"):
+    """Create (and train, for IVF, quantized encodings and PCA) a FAISS index sized for the corpus
+
+    reduction is (kind, dimension) or None; "auto" picks it with choose_reduction().
+    """
+    index_type = choose_index_type(vector_count)
+    quantization = choose_quantization(vector_count)
+    encoding = {None: "Flat", "sq8": "SQ8", "pq": f"PQ{PQ_M}"}[quantization]
+    metric = faiss.METRIC_INNER_PRODUCT if INDEX_METRIC == "cosine" else faiss.METRIC_L2
+    if reduction == "auto":
+        reduction = choose_reduction(vector_count, dimension)
+    transform = get_reduction_transform(reduction, metric)
+
+    if index_type == "ivf":
+        # ~sqrt(N) lists keeps both list scans and centroid search small
+        nlist = max(1, min(int(math.sqrt(vector_count)), len(training_vectors)))
+        index = faiss.index_factory(dimension, f"{transform}IVF{nlist},{encoding}", metric)
+    elif index_type == "hnsw":
+        hnsw = f"HNSW{HNSW_M}" if quantization is None else f"HNSW{HNSW_M}_{encoding}"
+        index = faiss.index_factory(dimension, f"IDMap,{transform}{hnsw}", metric)
+        get_base_index(index).hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+    else:
+        index = faiss.index_factory(dimension, f"IDMap,{transform}{encoding}", metric)
+
+    if not index.is_trained:
+        index.train(np.ascontiguousarray(training_vectors, dtype=np.float32))
+
+    configure_search_parameters(index)
+    return index
+
+def get_index_metric(index):
+    """Name the metric of an index: "cosine" (inner product over normalized vectors) or "l2\""""
+    return "cosine" if index.metric_type == faiss.METRIC_INNER_PRODUCT else "l2"
+
+def prepare_vectors(vectors, metric):
+    """Contiguous float32 copy of vectors, L2-normalized for the cosine metric"""
+    vectors = np.array(vectors, dtype=np.float32, order="C")
+    if metric == "cosine" and len(vectors):
+        faiss.normalize_L2(vectors)
+    return vectors
+
+def to_distances(index, scores):
+    """Turn raw FAISS scores into distances (lower is closer): inner products become cosine distance"""
+    if index.metric_type == faiss.METRIC_INNER_PRODUCT:
+        return 1 - scores
+    return scores
+
+def distance_to_similarity(distance, metric=INDEX_METRIC):
+    """Cosine similarity for a search distance, comparable across queries and index types
+
+    For "l2" this assumes normalized embeddings (true of the sentence-transformers
+    models used here), where squared L2 distance = 2 - 2 * cosine similarity.
+    """
+    if metric == "cosine":
+        return 1 - distance
+    return 1 - distance / 2
+
+def similarity_to_distance(similarity, metric=INDEX_METRIC):
+    """Inverse of distance_to_similarity()"""
+    if metric == "cosine":
+        return 1 - similarity
+    return 2 * (1 - similarity)
+
+def range_search_index(index, queries, max_distance, params=None):
+    """Every (distance, vector id) within max_distance of each query, closest first
+
+    Indexes whose faiss build has no range search fall back to k-NN searches
+    with a growing k until the farthest hit is out of range.
+    """
+    inner_product = index.metric_type == faiss.METRIC_INNER_PRODUCT
+    try:
+        lims, distances, vector_ids = index.range_search(
+            queries, 1 - max_distance if inner_product else max_distance, params=params
+        )
+    except RuntimeError:
+        return [knn_range_search(index, query, max_distance, params) for query in queries]
+
+    distances = to_distances(index, distances)
+    return [
+        sorted(zip(distances[lims[i]:lims[i + 1]], vector_ids[lims[i]:lims[i + 1]]), key=lambda hit: hit[0])
+        for i in range(len(queries))
+    ]
+
+def knn_range_search(index, query, max_distance, params=None):
+    """Range search for one query by repeated k-NN search (see range_search_index())"""
+    k = 64
+    while True:
+        k = min(k, index.ntotal)
+        distances, vector_ids = index.search(query.reshape(1, -1), k, params=params)
+        hits = [
+            (distance, vector_id)
+            for distance, vector_id in zip(to_distances(index, distances[0]), vector_ids[0]) if vector_id >= 0
+        ]
+        if k >= index.ntotal or (hits and hits[-1][0] > max_distance):
+            return [hit for hit in hits if hit[0] <= max_distance]
+        k *= 4
+
+def get_base_index(index):
+    """Unwrap id maps and pre-transforms to reach the index that does the search"""
+    index = faiss.downcast_index(index)
+    while isinstance(index, (faiss.IndexIDMap, faiss.IndexIDMap2, faiss.IndexPreTransform)):
+        index = faiss.downcast_index(index.index)
+    return index
+
+def get_index_type(index):
+    """Name the index family: flat, ivf or hnsw"""
+    base_index = get_base_index(index)
+    if isinstance(base_index, faiss.IndexIVF):
+        return "ivf"
+    if isinstance(base_index, faiss.IndexHNSW):
+        return "hnsw"
+    return "flat"
+
+def get_quantization(index):
+    """Name the vector encoding of an index: None (float32), sq8 or pq"""
+    base_index = get_base_index(index)
+    if isinstance(base_index, faiss.IndexHNSW):
+        base_index = faiss.downcast_index(base_index.storage)
+    if isinstance(base_index, (faiss.IndexScalarQuantizer, faiss.IndexIVFScalarQuantizer)):
+        return "sq8"
+    if isinstance(base_index, (faiss.IndexPQ, faiss.IndexIVFPQ)):
+        return "pq"
+    return None
+
+def get_reduction(index):
+    """Name the dimensionality reduction of an index as (kind, reduced dimension), or None"""
+    index = faiss.downcast_index(index)
+    while isinstance(index, (faiss.IndexIDMap, faiss.IndexIDMap2)):
+        index = faiss.downcast_index(index.index)
+    if not isinstance(index, faiss.IndexPreTransform):
+        return None
+    transform = faiss.downcast_VectorTransform(index.chain.at(0))
+    return ("pca" if isinstance(transform, faiss.PCAMatrix) else "rotation"), transform.d_out
+
+def has_approximate_distances(index):
+    """Whether search distances are approximate (compressed codes or reduced vectors)"""
+    return get_quantization(index) is not None or get_reduction(index) is not None
+
+def supports_remove(index):
+    """HNSW graphs cannot drop vectors in place"""
+    return get_index_type(index) != "hnsw"
+
+def configure_search_parameters(index):
+    """Apply the nprobe / efSearch tunables from config"""
+    index_type = get_index_type(index)
+    if index_type == "ivf":
+        faiss.ParameterSpace().set_index_parameter(index, "nprobe", IVF_NPROBE)
+    elif index_type == "hnsw":
+        faiss.ParameterSpace().set_index_parameter(index, "efSearch", HNSW_EF_SEARCH)
+
+def accepts_search_params(index):
+    """Whether an index takes per-search parameters; a flat PQ index rejects any (IndexPQ::search)"""
+    return not isinstance(get_base_index(index), faiss.IndexPQ)
+
+def search_index(index, queries, k, excluded_ids, allowed_ids=None):
+    """k-NN search skipping tombstoned ids (or admitting only allowed_ids), as [(distance, vector id), ...] rows
+
+    Indexes that reject search parameters cannot take a selector, so their
+    hits are over-fetched and filtered here instead. Those are flat indexes,
+    which scan every vector anyway, so an allow list fetches them all.
+    """
+    if not accepts_search_params(index) and (excluded_ids or allowed_ids is not None):
+        if allowed_ids is not None:
+            allowed = set(allowed_ids)
+            keep = lambda vector_id: vector_id in allowed
+            fetch_k = index.ntotal
+        else:
+            keep = lambda vector_id: vector_id not in excluded_ids
+            fetch_k = min(k + len(excluded_ids), index.ntotal)
+        distances, vector_ids = index.search(queries, fetch_k)
+        return [
+            [hit for hit in zip(row_distances, row_ids) if keep(hit[1])][:k]
+            for row_distances, row_ids in zip(to_distances(index, distances), vector_ids)
+        ]
+
+    params = make_search_params(index, excluded_ids, allowed_ids)
+    distances, vector_ids = index.search(queries, k, params=params)
+    return [list(zip(row_distances, row_ids)) for row_distances, row_ids in zip(to_distances(index, distances), vector_ids)]
+
+def make_search_params(index, excluded_ids, allowed_ids=None):
+    """Build per-search parameters that skip tombstoned vector ids, or admit only allowed_ids
+
+    Allowed ids are always live, so an allow list needs no tombstone check. The
+    more selective the allow list, the more IVF lists / HNSW candidates are
+    visited, so a small filtered subset still fills the top k. Returns None for
+    indexes that reject parameters (see accepts_search_params()); range search
+    results of those are filtered by resolve_hits(), which skips removed ids.
+    """
+    if not accepts_search_params(index):
+        return None
+    if allowed_ids is not None:
+        batch = faiss.IDSelectorBatch(np.array(sorted(allowed_ids), dtype=np.int64))
+        selector = batch
+        selectivity = len(allowed_ids) / max(index.ntotal, 1)
+    elif excluded_ids:
+        batch = faiss.IDSelectorBatch(np.array(sorted(excluded_ids), dtype=np.int64))
+        selector = faiss.IDSelectorNot(batch)
+        selectivity = 1.0
+    else:
+        return None
+
+    index_type = get_index_type(index)
+    if index_type == "ivf":
+        nprobe = min(get_base_index(index).nlist, math.ceil(IVF_NPROBE / selectivity))
+        params = faiss.SearchParametersIVF(sel=selector, nprobe=max(nprobe, IVF_NPROBE))
+    elif index_type == "hnsw":
+        ef_search = min(max(index.ntotal, 1), math.ceil(HNSW_EF_SEARCH / selectivity))
+        params = faiss.SearchParametersHNSW(sel=selector, efSearch=max(ef_search, HNSW_EF_SEARCH))
+    else:
+        params = faiss.SearchParameters(sel=selector)
+    # SWIG does not keep the wrapped selectors alive on its own
+    params.referenced_selectors = (batch, selector)
+    return params
+
+def use_vector_service():
+    """Whether this process should send work to the vector service (never true inside the service)"""
+    return bool(VECTOR_SERVICE_ADDRESS) and "vectorstore" not in pinned_resources
 
-@st.cache_resource
 def get_embeddings():
-    """Get the embedding model"""
-    return HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL)
+    """Get the embedding engine: the vector service's when one is configured, else this process's"""
+    if "embeddings" in pinned_resources:
+        return pinned_resources["embeddings"]
+    if use_vector_service():
+        return get_remote_embeddings()
+    return load_embeddings()
 
 @st.cache_resource
+def load_embeddings():
+    """Load the embedding engine for EMBEDDING_BACKEND (batched, optionally multi-process)"""
+    if EMBEDDING_BACKEND == "onnx":
+        return OnnxEmbeddingEngine()
+    return EmbeddingEngine()
+
+@st.cache_resource
+def get_remote_embeddings():
+    """Get the vector service's embedding engine, which loads the model here only while the service is down"""
+    return RemoteEmbeddingEngine(fallback=load_embeddings)
+
+@st.cache_resource
+def get_cross_encoder():
+    """Get the cross-encoder used to re-rank search results"""
+    from sentence_transformers import CrossEncoder
+
+    return CrossEncoder(CROSS_ENCODER_MODEL)
+
 def get_vectorstore():
-    """Get or create the vector store with improved error handling"""
+    """Get this process's vector store, refreshed with changes other processes have saved"""
+    # An empty store is falsy (it has __len__), so test membership rather than the value
+    if "vectorstore" in pinned_resources:
+        vectorstore = pinned_resources["vectorstore"]
+    else:
+        vectorstore = load_vectorstore()
+    sync_vectorstore(vectorstore)
+    return vectorstore
+
+@st.cache_resource
+def load_vectorstore():
+    """Load or create the vector store with improved error handling (once per process)"""
+    os.makedirs(VECTORSTORE_PATH, exist_ok=True)
+
+    # ตรวจสอบว่าไฟล์ index_ids.npz มีอยู่จริงหรือไม่ (ไฟล์ index.pkl แบบเก่าจะถูกสร้างใหม่จากฐานข้อมูล)
+    if os.path.exists(ID_MAP_PATH):
+        try:
+            with index_lock(exclusive=False):
+                vectorstore = KnowledgeVectorStore.load(VECTORSTORE_PATH, mmap=INDEX_MMAP)
+                # เล่นซ้ำการเปลี่ยนแปลงที่ยังไม่ได้รวมเข้า index หลัก
+                replay_delta_log(vectorstore)
+
+            # INDEX_METRIC changed since the index was saved: rebuild it (from the embedding cache) before use
+            if vectorstore.index is not None and get_index_metric(vectorstore.index) != INDEX_METRIC:
+                with index_lock():
+                    sync_vectorstore(vectorstore)
+                    if get_index_metric(vectorstore.index) != INDEX_METRIC:
+                        compact_vectorstore(vectorstore)
+            return vectorstore
+        except Exception as e:
+            st.warning(f"Failed to load existing vector store, rebuilding from the database: {e}")
+
+    # ไม่มี index หรือโหลดไม่ได้ ให้สร้างใหม่จากข้อมูลในฐานข้อมูล
+    saved_before = os.path.exists(ID_MAP_PATH)
+    with index_lock():
+        # Another process starting at the same time may have built and saved it while this one waited
+        if not saved_before and os.path.exists(ID_MAP_PATH):
+            vectorstore = KnowledgeVectorStore.load(VECTORSTORE_PATH, mmap=INDEX_MMAP)
+            replay_delta_log(vectorstore)
+            return vectorstore
+        vectorstore = build_vectorstore(load_items_from_database())
+        compact_vectorstore(vectorstore)
+    return vectorstore
+
+def start_warmup():
+    """Load the embedding model and vector index in a background thread, once per process
+
+    Called on every app run; only the first call starts the thread. Pages can
+    check get_warmup_status() and show a warming-up state instead of blocking.
+    """
+    with warmup_lock:
+        if warmup_state["status"] != "idle":
+            return
+        warmup_state["status"] = "running"
+    # A file left by an earlier run would report this process ready before it is
+    if WARMUP_READY_FILE and os.path.exists(WARMUP_READY_FILE):
+        os.remove(WARMUP_READY_FILE)
+    threading.Thread(target=run_warmup, name="vectorstore-warmup", daemon=True).start()
+
+def run_warmup():
+    """Load the model, run a dummy encode and load the index (body of the warm-up thread)"""
+    started = time.perf_counter()
+    if use_vector_service():
+        # The service holds the model and index, so there is nothing to load here
+        try:
+            call_vector_service("info")
+            write_ready_file()
+            with warmup_lock:
+                warmup_state.update(status="ready", error=None, seconds=time.perf_counter() - started)
+            return
+        except (VectorServiceUnavailable, VectorServiceError):
+            pass
+
     try:
-        embeddings = get_embeddings()
-        vectorstore_path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "faiss_index")
-        
-        # ตรวจสอบว่าโฟลเดอร์ faiss_index มีอยู่หรือไม่
-        if not os.path.exists(vectorstore_path):
-            os.makedirs(vectorstore_path, exist_ok=True)
-        
-        index_path = os.path.join(vectorstore_path, "index.faiss")
-        docstore_path = os.path.join(vectorstore_path, "index.pkl")
-        
-        # ตรวจสอบว่าไฟล์ index.faiss และ index.pkl มีอยู่จริงหรือไม่
-        if os.path.exists(index_path) and os.path.exists(docstore_path):
+        # The first encode initialises lazily built kernels, so it is slow even after loading
+        get_embeddings().embed_query("warm up")
+        get_vectorstore()
+        write_ready_file()
+        status, error = "ready", None
+    except Exception as e:
+        status, error = "failed", str(e)
+
+    with warmup_lock:
+        warmup_state.update(status=status, error=error, seconds=time.perf_counter() - started)
+
+def write_ready_file():
+    """Create WARMUP_READY_FILE (holding this process's pid) for health checks, if configured"""
+    if not WARMUP_READY_FILE:
+        return
+    # Write a temporary file and rename it, so a health check never sees a partial file
+    temp_path = f"{WARMUP_READY_FILE}.{os.getpid()}.tmp"
+    with open(temp_path, "w") as f:
+        f.write(str(os.getpid()))
+    os.replace(temp_path, WARMUP_READY_FILE)
+
+def get_warmup_status():
+    """Warm-up status ({"status", "error", "seconds"}); "ready" means search will not block on loading"""
+    with warmup_lock:
+        return dict(warmup_state)
+
+def is_ready():
+    """Readiness flag for health checks"""
+    return get_warmup_status()["status"] == "ready"
+
+def load_items_from_database():
+    """Read every knowledge item that belongs in the vector store"""
+    conn = get_db_connection()
+    c = conn.cursor()
+    c.execute("SELECT id, title, content, category, tags FROM knowledge_items")
+    items = [dict(row) for row in c.fetchall()]
+    conn.close()
+    return items
+
+def split_into_chunks(content):
+    """Split content into overlapping passages that fit the embedding model"""
+    splitter = RecursiveCharacterTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
+    chunks = splitter.split_text(content)
+    return chunks if chunks else [content]
+
+def load_passages(chunk_refs):
+    """Get passage text for (knowledge item id, chunk number) pairs by re-chunking item content
+
+    Missing items or chunks (e.g. an item deleted since it was indexed) give an empty string.
+    """
+    doc_ids = list(set(doc_id for doc_id, _ in chunk_refs))
+    item_chunks = {}
+
+    conn = get_db_connection()
+    c = conn.cursor()
+    # Stay under SQLite's bound-parameter limit
+    for start in range(0, len(doc_ids), 500):
+        batch = doc_ids[start:start + 500]
+        placeholders = ",".join("?" * len(batch))
+        c.execute(f"SELECT id, content FROM knowledge_items WHERE id IN ({placeholders})", batch)
+        for row in c.fetchall():
+            item_chunks[row['id']] = split_into_chunks(row['content'])
+    conn.close()
+
+    passages = []
+    for doc_id, chunk in chunk_refs:
+        chunks = item_chunks.get(doc_id, [])
+        passages.append(chunks[chunk] if chunk < len(chunks) else "")
+    return passages
+
+def replace_item_vectors(vectorstore, doc_id, vectors):
+    """Replace a knowledge item's vectors (one per chunk, in chunk order) and log the change"""
+    with index_lock():
+        # Apply other processes' changes first so vector ids are not handed out twice
+        sync_vectorstore(vectorstore)
+        records = []
+
+        # ลบเวกเตอร์เดิมของรายการนี้ (ถ้ามี) ก่อนเพิ่มใหม่ เพื่อไม่ให้มีเวกเตอร์ซ้ำ
+        vector_ids = vectorstore.get_item_vector_ids(doc_id)
+        if vector_ids:
+            records.append({"op": "delete", "ids": vector_ids})
+        vector_ids = list(range(vectorstore.next_id, vectorstore.next_id + len(vectors)))
+        chunk_refs = [(doc_id, chunk) for chunk in range(len(vectors))]
+        records.append(make_add_record(chunk_refs, vector_ids, vectors))
+
+        for record in records:
+            apply_delta_record(vectorstore, record)
+
+        # บันทึกเฉพาะส่วนที่เปลี่ยนแปลงลง delta log
+        append_to_delta_log(vectorstore, records)
+
+def remove_item_vectors(vectorstore, doc_id):
+    """Remove a knowledge item's vectors and log the change"""
+    with index_lock():
+        sync_vectorstore(vectorstore)
+        vector_ids = vectorstore.get_item_vector_ids(doc_id)
+
+        # ไม่มีเวกเตอร์ของรายการนี้ในคลัง ไม่ต้องทำอะไร
+        if not vector_ids:
+            return
+
+        # ลบเฉพาะเวกเตอร์และเอกสารของรายการนี้
+        record = {"op": "delete", "ids": vector_ids}
+        apply_delta_record(vectorstore, record)
+        append_to_delta_log(vectorstore, [record])
+
+def make_add_record(chunk_refs, vector_ids, vectors):
+    """Build a delta log record that adds (knowledge item id, chunk number) pairs with precomputed vectors"""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    return {
+        "op": "add",
+        "ids": vector_ids,
+        "chunks": [list(chunk_ref) for chunk_ref in chunk_refs],
+        "dim": int(vectors.shape[1]),
+        "vectors": base64.b64encode(vectors.tobytes()).decode("ascii")
+    }
+
+def apply_delta_record(vectorstore, record):
+    """Apply one delta log record to an in-memory vector store
+
+    Records are idempotent so a log can be replayed onto a base index that
+    already contains some of its changes (e.g. after a crash mid-compaction).
+    Vector ids are never reused, so an id that is already present means its
+    add has been applied before.
+    """
+    if record["op"] == "delete":
+        vectorstore.remove(record["ids"])
+        return
+
+    vectors = np.frombuffer(base64.b64decode(record["vectors"]), dtype=np.float32)
+    vectors = vectors.reshape(-1, record["dim"])
+    positions = [i for i, vector_id in enumerate(record["ids"]) if vector_id not in vectorstore.chunks]
+    if positions:
+        chunk_refs = [tuple(record["chunks"][i]) for i in positions]
+        vectorstore.add(chunk_refs, vectors[positions], [record["ids"][i] for i in positions])
+
+def append_to_delta_log(vectorstore, records):
+    """Append records to the delta log, compacting once the log grows past the threshold
+
+    Compaction also re-creates the index when the corpus has crossed an index
+    type threshold or an IVF index has outgrown its trained centroids.
+    """
+    with index_lock():
+        with open(DELTA_LOG_PATH, "a", encoding="utf-8") as f:
+            # A synced store has replayed every complete record, so anything past
+            # its offset is a line torn by a writer that crashed mid-append
+            if vectorstore.saved_signature is not None and f.tell() > vectorstore.log_offset:
+                f.truncate(vectorstore.log_offset)
+            for record in records:
+                f.write(json.dumps(record) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+            if vectorstore.saved_signature is not None:
+                vectorstore.log_offset = f.tell()
+
+        if os.path.getsize(DELTA_LOG_PATH) >= DELTA_LOG_COMPACT_BYTES or vectorstore.needs_rebuild():
+            compact_vectorstore(vectorstore)
+
+def replay_delta_log(vectorstore):
+    """Apply logged changes past vectorstore.log_offset (all of them for a freshly loaded base index)"""
+    if not os.path.exists(DELTA_LOG_PATH):
+        vectorstore.log_offset = 0
+        return 0
+
+    replayed = 0
+    with open(DELTA_LOG_PATH, "rb") as f:
+        # A shorter log has been compacted and restarted; records are idempotent, so replay it all
+        if vectorstore.log_offset > os.fstat(f.fileno()).st_size:
+            vectorstore.log_offset = 0
+        f.seek(vectorstore.log_offset)
+        for line in f:
+            # บรรทัดที่เขียนไม่ครบ (โปรเซสล่มระหว่างเขียน) จะถูกตัดทิ้งโดยผู้เขียนคนถัดไป
+            if not line.endswith(b"\n"):
+                break
             try:
-                return FAISS.load_local(vectorstore_path, embeddings, allow_dangerous_deserialization=True)
-            except Exception as e:
-                st.warning(f"Failed to load existing vector store: {e}")
-                # สร้างใหม่และบันทึกทันที
-                empty_doc = Document(page_content="Initial document", metadata={"id": 0})
-                empty_store = FAISS.from_documents([empty_doc], embeddings)
-                empty_store.save_local(vectorstore_path)
-                return empty_store
+                record = json.loads(line)
+            except ValueError:
+                break
+            apply_delta_record(vectorstore, record)
+            replayed += 1
+            vectorstore.log_offset += len(line)
+    return replayed
+
+def compact_vectorstore(vectorstore):
+    """Merge the delta log into the base index files and truncate the log"""
+    with index_lock():
+        if vectorstore.needs_rebuild():
+            vectorstore.rebuild_index()
         else:
-            # สร้างเอกสารเริ่มต้นเพื่อหลีกเลี่ยง list index out of range
-            empty_doc = Document(page_content="Initial document", metadata={"id": 0})
-            empty_store = FAISS.from_documents([empty_doc], embeddings)
-            empty_store.save_local(vectorstore_path)
-            return empty_store
-    except Exception as e:
-        st.error(f"Critical error in get_vectorstore: {e}")
-        # ในกรณีที่มีข้อผิดพลาดร้ายแรง ให้สร้าง minimal vectorstore
-        embeddings = get_embeddings()
-        empty_doc = Document(page_content="Fallback document", metadata={"id": 0})
-        return FAISS.from_documents([empty_doc], embeddings)
-
-def add_to_vectorstore(doc_id, title, content, category, tags):
-    """Add a document to the vector store with improved error handling"""
+            vectorstore.merge_delta(VECTORSTORE_PATH)
+        vectorstore.save(VECTORSTORE_PATH)
+        open(DELTA_LOG_PATH, "w").close()
+        vectorstore.log_offset = 0
+
+        # Serve from the freshly written file instead of a private in-memory copy
+        if INDEX_MMAP:
+            vectorstore.map_index(VECTORSTORE_PATH)
+
+        # A log's worth of edits has replaced passages; the index worker prunes their cached vectors
+        embedding_cache_state["prune_due"] = True
+
+def prune_embedding_cache_if_due():
+    """prune_embedding_cache() once after each compaction (called by the index worker, outside the index lock)"""
+    if not embedding_cache_state["prune_due"]:
+        return 0
+    return prune_embedding_cache()
+
+def prune_embedding_cache():
+    """Drop cached vectors no current passage uses (edited or deleted text, other models); returns how many
+
+    Every current passage stays cached, which check_index_consistency() relies on.
+    """
+    embedding_cache_state["prune_due"] = False
+    keep_hashes = set(
+        text_hash(chunk) for item in load_items_from_database() for chunk in split_into_chunks(item['content'])
+    )
+    conn = get_db_connection()
     try:
-        # สร้าง metadata
-        metadata = {
-            "id": doc_id,
-            "title": title,
-            "category": category,
-            "tags": tags
-        }
-        
-        # แปลงข้อความเป็น Document object ของ Langchain
-        document = Document(page_content=content, metadata=metadata)
-        
-        # ใช้ try-except แยกสำหรับแต่ละขั้นตอนเพื่อระบุจุดที่เกิดข้อผิดพลาดได้ชัดเจน
+        return prune_cached_embeddings(conn, keep_hashes, get_embeddings().cache_name)
+    finally:
+        conn.close()
+
+def semantic_search(query, top_k=5, item_ids=None, min_similarity=None):
+    """Search for semantically similar chunks as (knowledge item id, chunk number, distance)
+
+    item_ids restricts the search to chunks of those knowledge items. With
+    min_similarity, every chunk at least that similar is returned instead of the
+    top_k closest (see distance_to_similarity()). With a vector service
+    configured the search runs there, or here while it is unavailable.
+    """
+    if use_vector_service():
         try:
-            vectorstore = get_vectorstore()
-        except Exception as e:
-            st.error(f"Error loading vector store: {e}")
-            # สร้าง vectorstore ใหม่เป็นฉบับเปล่าๆ
-            try:
-                embeddings = get_embeddings()
-                vectorstore = FAISS.from_documents([document], embeddings)
-                vectorstore_path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "faiss_index")
-                os.makedirs(vectorstore_path, exist_ok=True)
-                vectorstore.save_local(vectorstore_path)
-                return True
-            except Exception as e2:
-                st.error(f"Failed to create new vector store: {e2}")
-                return False
-        
-        # เพิ่มเอกสารเข้า vectorstore อย่างปลอดภัย
+            item_ids = list(item_ids) if item_ids is not None else None
+            results = call_vector_service("search", query=query, k=top_k, item_ids=item_ids, min_similarity=min_similarity)
+            return [tuple(result) for result in results]
+        except VectorServiceUnavailable:
+            pass
+
+    return batched_search(query, top_k, item_ids, min_similarity)
+
+def find_similar_passages(passages, k=1):
+    """Nearest stored chunks of each passage as (knowledge item id, chunk number, distance)
+
+    Passages are embedded like indexed content (through the embedding cache), so
+    a passage that is already indexed is found at distance ~0.
+    """
+    if use_vector_service():
         try:
-            # ถ้ามีเอกสารในคลังอยู่แล้ว ให้ใช้ add_documents
-            if len(vectorstore.index_to_docstore_id) > 0:
-                vectorstore.add_documents([document])
-            # ถ้ายังไม่มีเอกสารใดๆ ให้สร้างใหม่ด้วย from_documents
-            else:
-                embeddings = get_embeddings()
-                vectorstore = FAISS.from_documents([document], embeddings)
-        except Exception as e:
-            st.error(f"Error adding document to vector store: {e}")
-            # ถ้าเกิด list index out of range ให้ลองสร้าง vectorstore ใหม่
+            return [
+                [tuple(hit) for hit in hits]
+                for hits in call_vector_service("similar_passages", passages=list(passages), k=k)
+            ]
+        except VectorServiceUnavailable:
+            pass
+
+    vectorstore = get_vectorstore()
+    vectors = get_embeddings().encode(list(passages))
+    return vectorstore.search_batch(vectors, k)
+
+def batched_search(query, k, item_ids=None, min_similarity=None):
+    """Run a search together with others arriving at the same time, see run_search_batch()
+
+    The first caller to find no batch running leads one: it takes every queued
+    search (up to QUERY_BATCH_MAX_SIZE), runs them and wakes their callers.
+    Searches arriving meanwhile queue up for the next batch, so batches grow with
+    load while a lone search runs straight away.
+    """
+    request = {
+        "query": query, "k": k, "item_ids": item_ids, "min_similarity": min_similarity,
+        "results": None, "error": None, "done": False
+    }
+    state = query_batch_state
+    with query_batch_condition:
+        state["pending"].append(request)
+        while not request["done"]:
+            if state["busy"]:
+                query_batch_condition.wait()
+                continue
+
+            state["busy"] = True
+            # Only wait for company when the last batch showed searches are concurrent
+            if QUERY_BATCH_WINDOW_MS and state["last_size"] > 1 and len(state["pending"]) < QUERY_BATCH_MAX_SIZE:
+                query_batch_condition.wait(QUERY_BATCH_WINDOW_MS / 1000)
+            batch = state["pending"][:QUERY_BATCH_MAX_SIZE]
+            del state["pending"][:QUERY_BATCH_MAX_SIZE]
+
+            query_batch_condition.release()
             try:
-                embeddings = get_embeddings()
-                vectorstore = FAISS.from_documents([document], embeddings)
-            except Exception as e2:
-                st.error(f"Failed to create vector store with new document: {e2}")
-                return False
-        
-        # บันทึก vectorstore
-        try:
-            vectorstore_path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "faiss_index")
-            os.makedirs(vectorstore_path, exist_ok=True)
-            vectorstore.save_local(vectorstore_path)
-            return True
-        except Exception as e:
-            st.error(f"Error saving vector store: {e}")
-            return False
-            
+                run_search_batch(batch)
+            finally:
+                query_batch_condition.acquire()
+                for batched_request in batch:
+                    batched_request["done"] = True
+                state.update(busy=False, last_size=len(batch), batches=state["batches"] + 1, queries=state["queries"] + len(batch))
+                query_batch_condition.notify_all()
+
+    if request["error"] is not None:
+        raise request["error"]
+    return request["results"]
+
+def run_search_batch(batch):
+    """Embed a batch of search requests together and search each (filter, k or threshold) group in one call
+
+    Results (or the error) are stored on each request.
+    """
+    try:
+        vectorstore = get_vectorstore()
+        vectors = embed_queries_cached([normalize_query(request["query"]) for request in batch])
+
+        groups = {}
+        for request, vector in zip(batch, vectors):
+            item_ids = request["item_ids"]
+            key = (request["k"], request["min_similarity"], None if item_ids is None else tuple(sorted(set(item_ids))))
+            groups.setdefault(key, []).append((request, vector))
+
+        # The searches lock the store themselves, and only around the index scan
+        for (k, min_similarity, item_ids), group in groups.items():
+            group_vectors = [vector for _, vector in group]
+            if min_similarity is not None:
+                results = vectorstore.range_search_batch(group_vectors, min_similarity, item_ids)
+            else:
+                results = vectorstore.search_batch(group_vectors, k, item_ids)
+            for (request, _), request_results in zip(group, results):
+                request["results"] = request_results
     except Exception as e:
-        st.error(f"Unexpected error in add_to_vectorstore: {e}")
-        return False
+        for request in batch:
+            request["error"] = e
+
+def get_query_batch_stats():
+    """How many semantic searches have run and in how many batches"""
+    with query_batch_condition:
+        batches = query_batch_state["batches"]
+        queries = query_batch_state["queries"]
+    return {"batches": batches, "queries": queries, "avg_size": queries / batches if batches else 0.0}
+
+def normalize_query(query):
+    """Collapse whitespace so trivially different spellings of a query share a cache entry"""
+    return " ".join(query.split())
+
+def embed_query_cached(query):
+    """Embed a normalized query, reusing the vector of recent identical queries"""
+    return embed_queries_cached([query])[0]
+
+def embed_queries_cached(queries):
+    """Embed normalized queries, reusing vectors of recent identical queries and encoding the rest in one batch"""
+    vectors = {}
+    with query_cache_lock:
+        for query in queries:
+            if query in query_cache:
+                query_cache.move_to_end(query)
+                vectors[query] = query_cache[query]
+
+    missing = list(dict.fromkeys(query for query in queries if query not in vectors))
+    if missing:
+        encoded = np.asarray(get_embeddings().embed_queries(missing), dtype=np.float32)
+        with query_cache_lock:
+            for query, vector in zip(missing, encoded):
+                # Shared between callers, so keep it from being modified in place
+                vector.flags.writeable = False
+                vectors[query] = query_cache[query] = vector
+            while len(query_cache) > QUERY_CACHE_SIZE:
+                query_cache.popitem(last=False)
+
+    with query_cache_lock:
+        query_cache_stats["misses"] += len(missing)
+        query_cache_stats["hits"] += len(queries) - len(missing)
+    return [vectors[query] for query in queries]
+
+def get_query_cache_stats():
+    """Hit/miss counters of the query embedding cache"""
+    with query_cache_lock:
+        hits = query_cache_stats["hits"]
+        misses = query_cache_stats["misses"]
+        size = len(query_cache)
+    lookups = hits + misses
+    return {
+        "hits": hits,
+        "misses": misses,
+        "size": size,
+        "max_size": QUERY_CACHE_SIZE,
+        "hit_rate": hits / lookups if lookups else 0.0
+    }
+
+def cross_encoder_scores(query, passages, budget_ms=CROSS_ENCODER_BUDGET_MS):
+    """Score (query, passage) pairs with the cross-encoder, batch by batch, until the budget is spent
+
+    Returns one relevance score per passage (higher is better), or None for
+    passages left unscored when the budget ran out. Batches go in order, so the
+    scored passages are always a prefix of the list.
+    """
+    model = get_cross_encoder()
+    scores = [None] * len(passages)
+    started = time.perf_counter()
+
+    for start in range(0, len(passages), CROSS_ENCODER_BATCH_SIZE):
+        if (time.perf_counter() - started) * 1000 >= budget_ms:
+            break
+        batch = passages[start:start + CROSS_ENCODER_BATCH_SIZE]
+        batch_scores = model.predict([(query, passage) for passage in batch], batch_size=len(batch))
+        scores[start:start + len(batch)] = [float(score) for score in batch_scores]
+
+    elapsed = (time.perf_counter() - started) * 1000
+    scored = [score for score in scores if score is not None]
+    with cross_encoder_stats_lock:
+        cross_encoder_stats["queries"] += 1
+        cross_encoder_stats["candidates"] += len(passages)
+        cross_encoder_stats["scored"] += len(scored)
+        cross_encoder_stats["ms"] += elapsed
+        cross_encoder_stats["over_budget"] += len(scored) < len(passages)
+        # A changed top result is where re-ranking actually buys precision
+        cross_encoder_stats["reordered"] += bool(scored) and max(scored) > scored[0]
+    return scores
+
+def get_cross_encoder_stats():
+    """Cumulative cross-encoder re-ranking timings and how often it changed the top result"""
+    with cross_encoder_stats_lock:
+        stats = dict(cross_encoder_stats)
+    queries = stats["queries"]
+    stats["avg_ms"] = stats["ms"] / queries if queries else 0.0
+    stats["reordered_rate"] = stats["reordered"] / queries if queries else 0.0
+    return stats
+
+def build_vectorstore(knowledge_items, progress_callback=None):
+    """Embed knowledge items into a new in-memory vector store"""
+    chunk_refs = []
+    texts = []
 
-def semantic_search(query, top_k=5):
-    """Search for semantically similar documents"""
-    vectorstore = get_vectorstore()
-    results = vectorstore.similarity_search_with_score(query, k=top_k)
-    return results
-
-def rebuild_vectorstore(knowledge_items):
-    """Rebuild the entire vector store from scratch"""
-    embeddings = get_embeddings()
-    documents = []
-    
     for item in knowledge_items:
-        doc_id = item['id']
-        title = item['title']
-        content = item['content']
-        category = item['category']
-        tags = item['tags']
-        
-        metadata = {
-            "id": doc_id,
-            "title": title,
-            "category": category,
-            "tags": tags
-        }
-        
-        document = Document(page_content=content, metadata=metadata)
-        documents.append(document)
-    
-    # Create new vectorstore
-    if documents:
-        vectorstore = FAISS.from_documents(documents, embeddings)
-        vectorstore.save_local(VECTORSTORE_PATH)
-        return True
+        for chunk, text in enumerate(split_into_chunks(item['content'])):
+            chunk_refs.append((item['id'], chunk))
+            texts.append(text)
+
+    # All chunks are embedded together in batches; the index type is picked for the corpus size
+    vectorstore = KnowledgeVectorStore()
+    if texts:
+        vectors = get_embeddings().encode(texts, progress_callback=progress_callback)
+        vectorstore.add(chunk_refs, vectors)
+    return vectorstore
+
+def rebuild_vectorstore(progress_callback=None):
+    """Rebuild the entire vector store from the database, returning the ids of the items it indexed
+
+    progress_callback(done, total) is called as chunk embeddings are computed.
+    Embedding runs without the index lock, so the index worker keeps applying
+    edits meanwhile; items whose vectors it changed after the rebuild started
+    are carried over from the live store before the rebuilt one replaces it
+    and the delta log is truncated. Those are left out of the returned ids,
+    since the worker flags them itself.
+    """
+    live_store = get_vectorstore()
+    with index_lock():
+        sync_vectorstore(live_store)
+        started_with = {doc_id: list(vector_ids) for doc_id, vector_ids in live_store.item_vector_ids.items()}
+
+    # Read after the live state is recorded, so an edit indexed in between shows up as a change
+    knowledge_items = load_items_from_database()
+    vectorstore = build_vectorstore(knowledge_items, progress_callback)
+
+    with index_lock():
+        sync_vectorstore(live_store)
+        changed_ids = set(
+            doc_id for doc_id in set(started_with) | set(live_store.item_vector_ids)
+            if started_with.get(doc_id) != live_store.item_vector_ids.get(doc_id)
+        )
+        carry_over_items(vectorstore, live_store, changed_ids)
+
+        # The fresh base index supersedes every logged change
+        compact_vectorstore(vectorstore)
+
+    # Cached copies, in this process and others, reload the rebuilt index on their next access
+    return [item['id'] for item in knowledge_items if item['id'] not in changed_ids]
+
+def carry_over_items(vectorstore, live_store, doc_ids):
+    """Give a rebuilt store the live store's version of some items (vectors come from the embedding cache)"""
+    chunk_refs = []
+    for doc_id in doc_ids:
+        vectorstore.remove(vectorstore.get_item_vector_ids(doc_id))
+        chunk_refs.extend(live_store.chunks[vector_id] for vector_id in sorted(live_store.get_item_vector_ids(doc_id)))
+    if chunk_refs:
+        vectorstore.add(chunk_refs, get_embeddings().encode(load_passages(chunk_refs)))
+
+def evaluate_index_recall(k=10, sample_size=200):
+    """Measure recall@k of the live index against exact flat search over the same passages
+
+    Stored passages are used as queries, so this needs no labelled data and no
+    model inference beyond what the embedding cache does not already hold.
+    """
+    vectorstore = get_vectorstore()
+    with vectorstore_lock:
+        if not vectorstore.chunks:
+            return None
+        chunk_refs = [vectorstore.chunks[vector_id] for vector_id in sorted(vectorstore.chunks)]
+
+    # Encoding the corpus can take a while, so searches are not held up meanwhile
+    vectors, sample, exact_positions = get_exact_neighbours(chunk_refs, vectorstore.metric, k, sample_size)
+    recall = measure_recall(vectorstore, chunk_refs, vectors, sample, exact_positions)
+
+    reduction = get_reduction(vectorstore.index)
+    return {
+        "recall": recall,
+        "k": exact_positions.shape[1],
+        "queries": len(sample),
+        "index_type": get_index_type(vectorstore.index),
+        "quantization": get_quantization(vectorstore.index) or "none",
+        "metric": vectorstore.metric,
+        "dimension": reduction[1] if reduction else vectors.shape[1],
+        "index_bytes": get_index_bytes(vectorstore)
+    }
+
+def evaluate_reduction_tradeoff(dimensions=None, k=10, sample_size=200):
+    """Compare recall@k, search time and index size of the corpus indexed at several reduced dimensions
+
+    Each candidate is a temporary index built like the live one (same index
+    type, encoding and metric) with only the reduction changed, so the rows show
+    what INDEX_REDUCED_DIM would cost on this corpus. "index_recall" and
+    "ms_per_query" are for the FAISS search alone; "recall" is what searches
+    return after exact re-ranking of RERANK_FACTOR x k candidates. dimensions
+    defaults to the full dimension and its 3/4, 1/2 and 1/4. Returns one row
+    per dimension, or None for an empty index.
+    """
+    vectorstore = get_vectorstore()
+    with vectorstore_lock:
+        if not vectorstore.chunks:
+            return None
+        chunk_refs = [vectorstore.chunks[vector_id] for vector_id in sorted(vectorstore.chunks)]
+    vectors, sample, exact_positions = get_exact_neighbours(chunk_refs, vectorstore.metric, k, sample_size)
+
+    full_dimension = vectors.shape[1]
+    dimensions = dimensions or [full_dimension, full_dimension * 3 // 4, full_dimension // 2, full_dimension // 4]
+    kind = INDEX_REDUCTION or "pca"
+    rows = []
+    for dimension in dimensions:
+        reduction = (kind, dimension) if dimension < full_dimension else None
+        if reduction and kind == "pca" and len(chunk_refs) < full_dimension:
+            # Too few passages to learn a PCA projection from
+            continue
+
+        index = create_index(full_dimension, len(chunk_refs), vectors, reduction=reduction)
+        index.add_with_ids(vectors, np.arange(len(chunk_refs), dtype=np.int64))
+        started = time.perf_counter()
+        _, found_positions = index.search(vectors[sample], exact_positions.shape[1])
+        ms = (time.perf_counter() - started) * 1000 / len(sample)
+        index_hits = sum(len(set(found) & set(expected)) for found, expected in zip(found_positions, exact_positions))
+
+        candidate = KnowledgeVectorStore(index, dict(enumerate(chunk_refs)), len(chunk_refs))
+        rows.append({
+            "dimension": dimension,
+            "reduction": kind if reduction else "none",
+            "index_recall": index_hits / exact_positions.size,
+            "recall": measure_recall(candidate, chunk_refs, vectors, sample, exact_positions),
+            "ms_per_query": ms,
+            "index_bytes": faiss.serialize_index(index).nbytes
+        })
+    return rows
+
+def get_exact_neighbours(chunk_refs, metric, k, sample_size):
+    """Embed passages (from the cache) and find a sample's exact k nearest neighbours by brute force
+
+    Returns (vectors, sample positions, neighbour positions per sampled query).
+    """
+    vectors = prepare_vectors(get_embeddings().encode(load_passages(chunk_refs)), metric)
+    if metric == "cosine":
+        exact_index = faiss.IndexFlatIP(vectors.shape[1])
+    else:
+        exact_index = faiss.IndexFlatL2(vectors.shape[1])
+    exact_index.add(vectors)
+
+    rng = np.random.default_rng(0)
+    sample = rng.choice(len(chunk_refs), size=min(sample_size, len(chunk_refs)), replace=False)
+    _, exact_positions = exact_index.search(vectors[sample], min(k, len(chunk_refs)))
+    return vectors, sample, exact_positions
+
+def measure_recall(vectorstore, chunk_refs, vectors, sample, exact_positions):
+    """Share of the exact neighbours that a store's search returns"""
+    all_results = vectorstore.search_batch(vectors[sample], exact_positions.shape[1])
+
+    hits = 0
+    for results, expected in zip(all_results, exact_positions):
+        found = {(doc_id, chunk) for doc_id, chunk, _ in results}
+        hits += sum(1 for position in expected if chunk_refs[position] in found)
+    return hits / exact_positions.size
+
+def get_index_bytes(vectorstore):
+    """Size of the base index plus the in-memory delta index"""
+    # A mapped IVF index serializes only a reference to its inverted lists
+    if vectorstore.read_only:
+        size = os.path.getsize(os.path.join(VECTORSTORE_PATH, "index.faiss"))
     else:
-        # Create vectorstore with a placeholder doc (empty list crashes FAISS)
-        empty_doc = Document(page_content="Initial document", metadata={"id": 0})
-        vectorstore = FAISS.from_documents([empty_doc], embeddings)
-        vectorstore.save_local(VECTORSTORE_PATH)
-        return True
\ No newline at end of file
+        size = faiss.serialize_index(vectorstore.index).nbytes
+    if vectorstore.delta_ids:
+        size += faiss.serialize_index(vectorstore.delta_index).nbytes
+    return int(size)